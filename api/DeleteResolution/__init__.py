@@ -2,22 +2,10 @@ import azure.functions as func
 from shared_src import GLOBAL_HEADERS
 from shared_src.databases import database
 from shared_src.HandleInput import parse_input, create_error_response, parse_login
-from os import environ
 import json
 
-# Database
-DATABASE = database.Database(
-    username=environ["ALTIMETRY_USERNAME"],
-    password=environ["ALTIMETRY_PASSWORD"],
-    host=environ["ALTIMETRY_HOST"],
-    port=environ["ALTIMETRY_DATABASE_PORT"],
-    database_name=environ["ALTIMETRY_DATABASE"],
-    engine=environ["ALTIMETRY_DATABASE_CONNECTION_ENGINE"],
-    database_type=environ["ALTIMETRY_DATABASE_TYPE"],
-    create_tables=environ["ALTIMETRY_CREATE_TABLES"] == 'true'
-)
-
 def main(req: func.HttpRequest) -> func.HttpResponse:
+    DATABASE = database.get_database()
     # login
     if not parse_login(req, DATABASE):
         return func.HttpResponse(
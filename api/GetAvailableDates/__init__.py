@@ -0,0 +1,41 @@
+import azure.functions as func
+from shared_src import GLOBAL_HEADERS
+from shared_src.databases import database
+from shared_src.HandleInput import parse_input, create_error_response, catalogue_response
+from typing import Any, Dict, List, Sequence
+from datetime import date, datetime, timedelta
+import json
+
+def date_ranges(dates: Sequence[date | datetime], step: int) -> List[List[str]]:
+    """
+    Run-length encodes sorted dates as [start, end] ranges (both included).
+    A range continues as long as the next date is step days after the previous one.
+    """
+    ranges: List[List[date]] = []
+    for day in dates:
+        day = day.date() if isinstance(day, datetime) else day
+        if ranges and day - ranges[-1][1] == timedelta(days=step):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [[start.isoformat(), end.isoformat()] for start, end in ranges]
+
+def get_available_dates(db: database.Database, resolution_id: int, step: int) -> Dict[str, Any]:
+    """Available dates of a resolution as the response body"""
+    dates = db.get_grid_dates(resolution_id)
+    return {"status": "success", "step": step, "count": len(dates), "ranges": date_ranges(dates, step)}
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    DATABASE = database.get_database()
+    # Get resolution name
+    if (resolution_name := parse_input(req, 'resolution_name')) is None:
+        return create_error_response('resolution_name', "has an invalid format", resolution_name, 400, "'string'")
+
+    def make_body() -> Dict[str, Any] | func.HttpResponse:
+        # The resolution is only looked up when the dates are not cached
+        if (resolution := DATABASE.get_resolutions_by_name(resolution_name)) is None:
+            return func.HttpResponse(json.dumps({"status": "failed", "error": "resolution did not exist"}), status_code = 400, headers=GLOBAL_HEADERS)
+        # Grids are stored every time_days days
+        step = max(int(resolution.time_days or 1), 1)
+        return get_available_dates(DATABASE, resolution.id, step)
+    return catalogue_response(req, ("dates", resolution_name), make_body)
@@ -0,0 +1,81 @@
+import azure.functions as func
+from shared_src import GLOBAL_HEADERS, exports
+from shared_src.HandleInput import parse_input, create_error_response
+from os import environ
+from typing import Optional, Tuple
+import json
+import re
+
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def chunk_size() -> int:
+    """Largest part of an archive sent in one response (ALTIMETRY_EXPORT_CHUNK_MB, default 64 MB)"""
+    return int(float(environ.get("ALTIMETRY_EXPORT_CHUNK_MB", 64)) * 1024 ** 2)
+
+def parse_range(header: Optional[str], size: int) -> Tuple[int, int] | None:
+    """
+    (start, end) with end included of a single range Range header (e.g. bytes=0-1023, bytes=1024- or bytes=-512).
+    No header is the whole archive. None if the range is invalid or outside the archive.
+    """
+    if header is None:
+        return 0, size - 1
+    if (match := RANGE.match(header.strip())) is None or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # A suffix of no bytes (bytes=-0) can not be satisfied
+        if int(last) == 0 or size == 0:
+            return None
+        return max(size - int(last), 0), size - 1
+    start, end = int(first), size - 1 if last == '' else min(int(last), size - 1)
+    if start > end:
+        return None
+    return start, end
+
+def download_response(req: func.HttpRequest, store: exports.ExportStore, job_id: str) -> func.HttpResponse:
+    """
+    Responds with the archive of a finished job.
+    The http output binding needs the whole body, so at most chunk_size bytes are read per response.
+    Larger archives are sent as partial responses (206 with Content-Range) and the rest is downloaded with Range requests.
+    If ALTIMETRY_EXPORT_URL is set the archives are served from storage and the client is redirected there instead.
+    """
+    path = store.archive(job_id)
+    if (base_url := environ.get("ALTIMETRY_EXPORT_URL")) is not None:
+        return func.HttpResponse(status_code=302, headers={**GLOBAL_HEADERS, "Location": f"{base_url.rstrip('/')}/{path.name}"})
+    size = path.stat().st_size
+    if (requested := parse_range(req.headers.get("Range"), size)) is None:
+        return func.HttpResponse(status_code=416, headers={**GLOBAL_HEADERS, "Content-Range": f"bytes */{size}"})
+    start, end = requested
+    end = min(end, start + chunk_size() - 1)
+    partial = (start, end) != (0, size - 1)
+    return func.HttpResponse(
+        store.read_archive(job_id, start, end - start + 1),
+        status_code = 206 if partial else 200,
+        mimetype="application/zip",
+        headers={
+            **GLOBAL_HEADERS,
+            "Content-Disposition": f'attachment; filename="AltimetryGridding_{job_id[:8]}.zip"',
+            "Accept-Ranges": "bytes",
+            **({"Content-Range": f"bytes {start}-{end}/{size}"} if partial else {}),
+            "Access-Control-Expose-Headers": "Content-Disposition, Content-Range, Accept-Ranges"
+        }
+    )
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    store = exports.get_store()
+    # Get job id
+    job_id = parse_input(req, 'job_id')
+    if job_id is None or (status := store.status(job_id)) is None:
+        return create_error_response('job_id', "did not match an export job", job_id, 404, None)
+
+    # Download the archive
+    if parse_input(req, 'download') == 'true':
+        if status["state"] != exports.DONE:
+            return create_error_response('job_id', "is not done", status["state"], 409, exports.DONE)
+        return download_response(req, store, job_id)
+
+    # Status and progress of the job
+    body = {"status": "success", **status}
+    if status["state"] == exports.DONE:
+        body["download_url"] = f"/api/GetExport?job_id={job_id}&download=true"
+    return func.HttpResponse(json.dumps(body), status_code=200, headers=GLOBAL_HEADERS)
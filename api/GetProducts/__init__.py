@@ -1,24 +1,11 @@
 import azure.functions as func
 from shared_src import GLOBAL_HEADERS
 from shared_src.databases import database
-from shared_src.HandleInput import parse_input
-from os import environ
+from shared_src.HandleInput import parse_input, catalogue_response
 from typing import Any
 import json
 import traceback
 
-# Database
-DATABASE = database.Database(
-    username=environ["ALTIMETRY_USERNAME"],
-    password=environ["ALTIMETRY_PASSWORD"],
-    host=environ["ALTIMETRY_HOST"],
-    port=environ["ALTIMETRY_DATABASE_PORT"],
-    database_name=environ["ALTIMETRY_DATABASE"],
-    engine=environ["ALTIMETRY_DATABASE_CONNECTION_ENGINE"],
-    database_type=environ["ALTIMETRY_DATABASE_TYPE"],
-    create_tables=environ["ALTIMETRY_CREATE_TABLES"] == 'true'
-)
-
 def check_resolution(resolution: Any | None) -> bool:
     """ Check if resolution was defined and if it is true"""
     if resolution is None:
@@ -34,19 +21,19 @@ def check_resolution(resolution: Any | None) -> bool:
     return False
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
-    resolution = parse_input(req, "resolution")
+    DATABASE = database.get_database()
+    resolution = check_resolution(parse_input(req, "resolution"))
     
     # Get resolution if requested
     try:
-        if check_resolution(resolution):
-            products = DATABASE.get_product_and_resolutions()
-            response_type = "both"
-        else:
-            # Get products from the database
-            products = DATABASE.get_product_names()
-            response_type = "product"
-        return func.HttpResponse(json.dumps({"status": "success", "type": response_type, "products": products}), status_code = 200, headers=GLOBAL_HEADERS)
+        if resolution:
+            return catalogue_response(req, ("products", True), lambda: {
+                "status": "success", "type": "both", "products": DATABASE.get_product_and_resolutions()
+            })
+        # Get products from the database
+        return catalogue_response(req, ("products", False), lambda: {
+            "status": "success", "type": "product", "products": list(DATABASE.get_product_names())
+        })
     except Exception as e:
         trace = traceback.format_exception(e)
         return func.HttpResponse(json.dumps({"status": "failed" , "error" : trace}), status_code = 400, headers=GLOBAL_HEADERS)
-    
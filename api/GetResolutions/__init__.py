@@ -1,23 +1,22 @@
 import azure.functions as func
 from shared_src import GLOBAL_HEADERS
 from shared_src.databases import database, tables
-from shared_src.HandleInput import parse_input, create_error_response
-from os import environ
+from shared_src.HandleInput import parse_input, create_error_response, catalogue_response
+from typing import Any, Dict
 import json
 
-# Database
-DATABASE = database.Database(
-    username=environ["ALTIMETRY_USERNAME"],
-    password=environ["ALTIMETRY_PASSWORD"],
-    host=environ["ALTIMETRY_HOST"],
-    port=environ["ALTIMETRY_DATABASE_PORT"],
-    database_name=environ["ALTIMETRY_DATABASE"],
-    engine=environ["ALTIMETRY_DATABASE_CONNECTION_ENGINE"],
-    database_type=environ["ALTIMETRY_DATABASE_TYPE"],
-    create_tables=environ["ALTIMETRY_CREATE_TABLES"] == 'true'
-)
+def get_resolutions(db: database.Database, product_name: Any, product_id: Any) -> Dict[str, Any] | func.HttpResponse:
+    """Resolutions of a product as the response body or an error response"""
+    resolutions = db.get_resolutions_by_product(product_name=product_name, product_id=product_id)
+    if resolutions is None:
+        return func.HttpResponse(json.dumps({"status": "failed", "error": "product did not exist"}), status_code = 400, headers=GLOBAL_HEADERS)
+    
+    # If successfull format the resolution table
+    resolution_dict = tables.get_fields_as_dict(resolutions)
+    return {"status": "success", "resolutions": resolution_dict}
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
+    DATABASE = database.get_database()
     # Get product name or id
     product_name = parse_input(req, 'name')
     product_id = parse_input(req, 'id')
@@ -32,12 +31,6 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
     # Get resolutions from the database
     try:
-        resolutions = DATABASE.get_resolutions_by_product(product_name=product_name, product_id=product_id)
-        if resolutions is None:
-            return func.HttpResponse(json.dumps({"status": "failed", "error": "product did not exist"}), status_code = 400, headers=GLOBAL_HEADERS)
-        
-        # If successfull format the resolution table
-        resolution_dict = tables.get_fields_as_dict(resolutions)
-        return func.HttpResponse(json.dumps({"status": "success", "resolutions": resolution_dict}), status_code = 200, headers=GLOBAL_HEADERS)
+        return catalogue_response(req, ("resolutions", product_name, product_id), lambda: get_resolutions(DATABASE, product_name, product_id))
     except ValueError as e:
-        return func.HttpResponse(json.dumps({"status": "failed", "error": e}), status_code = 400, headers=GLOBAL_HEADERS)
\ No newline at end of file
+        return func.HttpResponse(json.dumps({"status": "failed", "error": str(e)}), status_code = 400, headers=GLOBAL_HEADERS)
@@ -0,0 +1,102 @@
+import azure.functions as func
+from shared_src import GLOBAL_HEADERS
+from shared_src.databases import database
+from shared_src.HandleInput import (
+    parse_input, create_error_response, parse_name, parse_date, parse_bounding_box, parse_variables, parse_option
+)
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from datetime import datetime
+import csv
+import io
+import json
+
+FORMATS = ['json', 'csv']
+WEIGHTS = ['false', 'true']
+
+Statistics = Sequence[Tuple[datetime, Dict[str, Dict[str, Optional[float]]]]]
+
+def parse_polygon(req: func.HttpRequest, param: str) -> func.HttpResponse | database.Polygon | None:
+    """Check and converts the optional polygon (a JSON list of at least 3 [lat, lon] points) to the correct type or response."""
+    if (points := parse_input(req, param)) is None:
+        return None
+    try:
+        if isinstance(points, str):
+            points = json.loads(points)
+        polygon = database.Polygon(tuple((float(lat), float(lon)) for lat, lon in points))
+    except (TypeError, ValueError):
+        return create_error_response(param, "has an invalid format", points, 400, "list of [lat, lon] points")
+    if len(polygon.points) < 3:
+        return create_error_response(param, "has too few points", points, 400, "at least 3 [lat, lon] points")
+    if any(not (-90 <= lat <= 90 and -180 <= lon <= 180) for lat, lon in polygon.points):
+        return create_error_response(param, "is not a valid region", points, 400, "-90 <= lat <= 90 and -180 <= lon <= 180")
+    return polygon
+
+def statistics_json(statistics: Statistics) -> Dict[str, Any]:
+    """Statistics as the response body with one row per date"""
+    return {
+        "status": "success",
+        "statistics": database.Database.STATISTICS,
+        "rows": [{"date": day.date().isoformat(), **bands} for day, bands in statistics]
+    }
+
+def statistics_csv(statistics: Statistics, variables: Sequence[str]) -> str:
+    """Statistics as CSV with a row per date and a column per variable and statistic (no pixels is an empty field)"""
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(['date', *(f"{name}_{key}" for name in variables for key in database.Database.STATISTICS)])
+    for day, bands in statistics:
+        values: List[Any] = [bands[name][key] for name in variables for key in database.Database.STATISTICS]
+        writer.writerow([day.date().isoformat(), *('' if value is None else value for value in values)])
+    return output.getvalue()
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    DATABASE = database.get_database()
+    # Resolution name
+    if isinstance((resolution := parse_name(req, 'resolution_name')), func.HttpResponse):
+        return resolution
+
+    # Date range
+    if isinstance((start_date := parse_date(req, 'start_date')), func.HttpResponse):
+        return start_date
+    if isinstance((end_date := parse_date(req, 'end_date')), func.HttpResponse):
+        return end_date
+
+    # Region (a bounding box or a polygon, default is the whole grid)
+    if isinstance((bbox := parse_bounding_box(req)), func.HttpResponse):
+        return bbox
+    if isinstance((polygon := parse_polygon(req, 'polygon')), func.HttpResponse):
+        return polygon
+    if bbox is not None and polygon is not None:
+        return create_error_response('polygon', "can not be given with a bounding box", polygon.points, 400, None)
+
+    # Variables
+    if isinstance((variables := parse_variables(req, 'variables')), func.HttpResponse):
+        return variables
+    variables = variables or database.BANDS
+
+    # Area (cos(latitude)) weighting
+    if isinstance((weighted := parse_option(req, 'weighted', WEIGHTS)), func.HttpResponse):
+        return weighted
+
+    # Output format
+    if isinstance((output_format := parse_option(req, 'format', FORMATS)), func.HttpResponse):
+        return output_format
+
+    if (resolution_row := DATABASE.get_resolutions_by_name(resolution)) is None:
+        return create_error_response('resolution', "did not exist in the database", resolution, 400, None)
+
+    statistics = DATABASE.get_statistics(
+        resolution_row.id, start_date, end_date, bbox or polygon, variables, weighted == 'true'
+    )
+    if output_format == 'csv':
+        return func.HttpResponse(
+            statistics_csv(statistics, variables),
+            status_code=200,
+            mimetype="text/csv",
+            headers={
+                **GLOBAL_HEADERS,
+                "Content-Disposition": f'attachment; filename="{resolution}_{start_date}_{end_date}_statistics.csv"',
+                "Access-Control-Expose-Headers": "Content-Disposition"
+            }
+        )
+    return func.HttpResponse(json.dumps(statistics_json(statistics)), status_code=200, headers=GLOBAL_HEADERS)
@@ -0,0 +1,90 @@
+import azure.functions as func
+from shared_src import GLOBAL_HEADERS
+from shared_src.databases import database
+from shared_src.HandleInput import (
+    parse_input, create_error_response, parse_name, parse_date, parse_float, parse_variables, parse_option
+)
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from datetime import date, datetime
+import csv
+import io
+import json
+
+FORMATS = ['json', 'csv']
+
+def parse_optional_date(req: func.HttpRequest, param: str) -> func.HttpResponse | date | None:
+    """Check and converts the optional date with param name (the series is not limited in that direction without it)."""
+    if parse_input(req, param) is None:
+        return None
+    return parse_date(req, param)
+
+def parse_coordinate(req: func.HttpRequest, param: str, limit: float) -> func.HttpResponse | float:
+    """Check and converts the coordinate with param name to a float between -limit and limit or response."""
+    if isinstance((value := parse_float(req, param)), func.HttpResponse):
+        return value
+    if value is None or not -limit <= value <= limit:
+        return create_error_response(param, "has an invalid format", value, 400, f"float between -{limit} and {limit}")
+    return value
+
+def series_json(series: Sequence[Tuple[datetime, List[Optional[float]]]], variables: Sequence[str], lat: float, lon: float) -> Dict[str, Any]:
+    """Time series as the response body with one list of values per variable"""
+    return {
+        "status": "success",
+        "lat": lat,
+        "lon": lon,
+        "dates": [day.date().isoformat() for day, _ in series],
+        "values": {name: [values[index] for _, values in series] for index, name in enumerate(variables)}
+    }
+
+def series_csv(series: Sequence[Tuple[datetime, List[Optional[float]]]], variables: Sequence[str]) -> str:
+    """Time series as CSV with a row per date (nodata is an empty field)"""
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(['date', *variables])
+    for day, values in series:
+        writer.writerow([day.date().isoformat(), *('' if value is None else value for value in values)])
+    return output.getvalue()
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    DATABASE = database.get_database()
+    # Resolution name
+    if isinstance((resolution := parse_name(req, 'resolution_name')), func.HttpResponse):
+        return resolution
+
+    # Point
+    if isinstance((lat := parse_coordinate(req, 'lat', 90)), func.HttpResponse):
+        return lat
+    if isinstance((lon := parse_coordinate(req, 'lon', 180)), func.HttpResponse):
+        return lon
+
+    # Optional date range
+    if isinstance((start_date := parse_optional_date(req, 'start_date')), func.HttpResponse):
+        return start_date
+    if isinstance((end_date := parse_optional_date(req, 'end_date')), func.HttpResponse):
+        return end_date
+
+    # Variables
+    if isinstance((variables := parse_variables(req, 'variables')), func.HttpResponse):
+        return variables
+    variables = variables or database.BANDS
+
+    # Output format
+    if isinstance((output_format := parse_option(req, 'format', FORMATS)), func.HttpResponse):
+        return output_format
+
+    if (resolution_row := DATABASE.get_resolutions_by_name(resolution)) is None:
+        return create_error_response('resolution', "did not exist in the database", resolution, 400, None)
+
+    series = DATABASE.get_time_series(resolution_row.id, lat, lon, start_date, end_date, variables)
+    if output_format == 'csv':
+        return func.HttpResponse(
+            series_csv(series, variables),
+            status_code=200,
+            mimetype="text/csv",
+            headers={
+                **GLOBAL_HEADERS,
+                "Content-Disposition": f'attachment; filename="{resolution}_{lat}_{lon}.csv"',
+                "Access-Control-Expose-Headers": "Content-Disposition"
+            }
+        )
+    return func.HttpResponse(json.dumps(series_json(series, variables, lat, lon)), status_code=200, headers=GLOBAL_HEADERS)
@@ -0,0 +1,50 @@
+"""
+Compares the HEX-encoded WKB encoder with the single buffer encoder.
+Run from the api folder: python -m benchmarks.encode
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Callable, Any
+import xarray as xr
+from shared_src.xarray_operations import encode
+from .synthetic import make_grid
+
+def measure(function: Callable[[], Any], repeats: int) -> tuple[float, float]:
+    """Returns the best time in seconds and the peak memory in MB of function"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak / 1e6
+
+def encoders(dataset: xr.Dataset) -> dict[str, Callable[[], Any]]:
+    """Encoders to compare"""
+    return {
+        'dataset_to_hexwkb': lambda: str(encode.dataset_to_hexwkb(dataset, srid=4326))[2:-1],
+        'dataset_to_wkb': lambda: encode.dataset_to_wkb(dataset, srid=4326),
+        'dataset_to_wkb (hex)': lambda: encode.dataset_to_wkb(dataset, srid=4326, as_hex=True),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--resolutions', type=float, nargs='+', default=[1.0, 0.25, 0.1])
+    parser.add_argument('--dtype', default='float64')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'resolution':>10} {'encoder':<22} {'time [s]':>10} {'MB/s':>10} {'peak [MB]':>10}")
+    for resolution in args.resolutions:
+        dataset = make_grid(resolution, args.dtype)
+        for name, function in encoders(dataset).items():
+            seconds, peak = measure(function, args.repeats)
+            throughput = dataset.nbytes / 1e6 / seconds
+            print(f"{resolution:>10} {name:<22} {seconds:>10.4f} {throughput:>10.1f} {peak:>10.1f}")
+
+if __name__ == '__main__':
+    main()
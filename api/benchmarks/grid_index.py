@@ -0,0 +1,44 @@
+"""
+Shows the query plan of the date range query used by getData without and with the (resolution_id, date) index.
+Needs a database with the ALTIMETRY_* environment variables set, which has been bootstrapped (see shared_src.databases.bootstrap).
+Run from the api folder: python -m benchmarks.grid_index --resolution-id 1 --start 2020-01-01 --end 2020-12-31
+"""
+import argparse
+from datetime import date
+from sqlalchemy import Connection
+from shared_src.databases import database, tables
+
+# Planner settings which makes postgres ignore the index, i.e. the plan before the index existed
+WITHOUT_INDEX = ['enable_indexscan', 'enable_indexonlyscan', 'enable_bitmapscan']
+
+def explain(connection: Connection, resolution_id: int, start_date: date, end_date: date) -> str:
+    """EXPLAIN ANALYZE of the date range query"""
+    statement = database.Database._select_grids().filter(
+        tables.Grid.resolution_id == resolution_id,
+        tables.Grid.date >= start_date,
+        tables.Grid.date <= end_date
+    )
+    compiled = statement.compile(dialect=connection.dialect)
+    rows = connection.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {compiled}", compiled.params)
+    return "\n".join(row[0] for row in rows)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--resolution-id', type=int, required=True)
+    parser.add_argument('--start', type=date.fromisoformat, required=True)
+    parser.add_argument('--end', type=date.fromisoformat, required=True)
+    args = parser.parse_args()
+
+    db = database.get_database()
+    with db.engine.connect() as connection:
+        with connection.begin():
+            for setting in WITHOUT_INDEX:
+                connection.exec_driver_sql(f"SET LOCAL {setting} = off")
+            print("Without (resolution_id, date) index:")
+            print(explain(connection, args.resolution_id, args.start, args.end))
+        with connection.begin():
+            print("\nWith (resolution_id, date) index:")
+            print(explain(connection, args.resolution_id, args.start, args.end))
+
+if __name__ == '__main__':
+    main()
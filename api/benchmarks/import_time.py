@@ -0,0 +1,66 @@
+"""
+Import time of each function (the cold start before main is called) measured with python -X importtime.
+Each function is imported in a new interpreter, so nothing is cached between the functions.
+Run from the api folder: python -m benchmarks.import_time
+"""
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+API_FOLDER = Path(__file__).resolve().parent.parent
+# Packages which are slow to import and should only be imported by the functions using them
+HEAVY_PACKAGES = ['xarray', 'numpy', 'pandas', 'scipy', 'bcrypt', 'geoalchemy2', 'sqlalchemy']
+
+class ImportTime(NamedTuple):
+    """Import time of a function in milliseconds"""
+    total: float
+    packages: Dict[str, float]
+
+def functions() -> List[str]:
+    """Names of the functions in the api folder"""
+    return sorted(path.parent.name for path in API_FOLDER.glob('*/function.json'))
+
+def import_time(module: str) -> ImportTime:
+    """Imports the module in a new interpreter and parses the -X importtime report"""
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=API_FOLDER, capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Failed to import {module}:\n{process.stderr}")
+    total = 0.0
+    packages: Dict[str, float] = {}
+    # Lines are "import time: self [us] | cumulative [us] | module" with the module indented by depth
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        if name.strip() == module:
+            total = int(cumulative) / 1000
+        elif package in HEAVY_PACKAGES and name.strip() == package:
+            packages[package] = int(cumulative) / 1000
+    return ImportTime(total, packages)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('functions', nargs='*', default=functions())
+    parser.add_argument('--repeats', type=int, default=3, help="The fastest import of the repeats is reported")
+    parser.add_argument('--max-ms', type=float, help="Exit with an error if a function takes longer to import")
+    args = parser.parse_args()
+
+    print(f"{'function':<18} {'import [ms]':>12}  heavy packages [ms]")
+    slow = []
+    for function in args.functions:
+        result = min((import_time(function) for _ in range(args.repeats)), key=lambda result: result.total)
+        packages = ", ".join(f"{package} {ms:.0f}" for package, ms in result.packages.items())
+        print(f"{function:<18} {result.total:>12.0f}  {packages}")
+        if args.max_ms is not None and result.total > args.max_ms:
+            slow.append(function)
+    if slow:
+        sys.exit(f"Import time of {', '.join(slow)} exceeded {args.max_ms} ms")
+
+if __name__ == '__main__':
+    main()
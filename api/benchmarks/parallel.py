@@ -0,0 +1,64 @@
+"""
+Scaling of the parallel per-day decoding, NetCDF encoding and compression of getData with the number of workers.
+The grids are synthetic, so no database is needed. The speedup is relative to a single worker
+(which runs without a thread pool) and is limited by the number of cores of the machine.
+Run from the api folder: python -m benchmarks.parallel
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, List, Sequence
+from shared_src import archive, parallel
+from shared_src.xarray_operations import decode, encode
+from shared_src.xarray_operations.netcdf import netcdf_file
+from .synthetic import make_grid, make_raster
+
+START = datetime(2020, 1, 1)
+
+def default_workers() -> List[int]:
+    """1, 2, 4, ... up to the number of cores"""
+    cores = os.cpu_count() or 1
+    workers = [1]
+    while workers[-1] * 2 <= cores:
+        workers.append(workers[-1] * 2)
+    if workers[-1] != cores:
+        workers.append(cores)
+    return workers
+
+def run(rasters: Sequence[Any], workers: int) -> int:
+    """Builds the archive like getData and returns its size"""
+    entries = parallel.ordered_map(
+        lambda raster: archive.compress(*netcdf_file(decode.raster_to_xarray(raster))),
+        rasters,
+        workers
+    )
+    return sum(map(len, archive.zip_chunks(entries)))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--resolution', type=float, default=0.25)
+    parser.add_argument('--dtype', default='float32')
+    parser.add_argument('--days', type=int, default=16)
+    parser.add_argument('--workers', type=int, nargs='+', default=default_workers())
+    parser.add_argument('--repeats', type=int, default=2)
+    args = parser.parse_args()
+
+    dataset = make_grid(args.resolution, args.dtype)
+    wkb = bytes(encode.dataset_to_wkb(dataset, srid=4326))
+    rasters = [make_raster(dataset, START + timedelta(days=day), wkb) for day in range(args.days)]
+    print(f"{args.days} days of {args.resolution} {args.dtype} grids on {os.cpu_count()} cores")
+    print(f"{'workers':>8} {'time [s]':>10} {'days/s':>8} {'speedup':>8} {'efficiency':>11}")
+    single = None
+    for workers in args.workers:
+        best = float('inf')
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            run(rasters, workers)
+            best = min(best, time.perf_counter() - start)
+        single = best if single is None else single
+        speedup = single / best
+        print(f"{workers:>8} {best:>10.3f} {args.days / best:>8.1f} {speedup:>8.2f} {speedup / workers:>11.0%}")
+
+if __name__ == '__main__':
+    main()
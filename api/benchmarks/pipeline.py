@@ -0,0 +1,107 @@
+"""
+Throughput and peak memory of each stage of the raster codec and the getData download pipeline.
+The grids are synthetic, so no database is needed. Results can be saved as a baseline and
+later runs compared to it. Timings depend on the machine, so the baseline (baselines.json) is not
+committed and has to be saved on the machine used for the comparison.
+Run from the api folder: python -m benchmarks.pipeline [--save | --compare]
+"""
+import argparse
+import json
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List
+import xarray as xr
+from shared_src import archive
+from shared_src.xarray_operations import encode, decode
+from shared_src.xarray_operations.netcdf import netcdf_entries
+from .encode import measure
+from .synthetic import make_grid, make_raster
+
+BASELINE = Path(__file__).resolve().parent / 'baselines.json'
+START = datetime(2020, 1, 1)
+
+def stages(dataset: xr.Dataset) -> Dict[str, Callable[[], Any]]:
+    """Stages of a single grid (in the order they run from ingest to download)"""
+    raster = make_raster(dataset, START)
+    grid = decode.raster_to_xarray(raster)
+    netcdf = grid.to_netcdf(None, engine='scipy')
+    return {
+        'encode.dataset_to_hexwkb': lambda: encode.dataset_to_hexwkb(dataset, srid=4326),
+        'encode.dataset_to_wkb': lambda: encode.dataset_to_wkb(dataset, srid=4326),
+        'encode.pack_dataset': lambda: encode.pack_dataset(dataset),
+        'decode.read_wkb_raster': lambda: decode.read_wkb_raster(raster.raster_wkb),
+        'decode.raster_to_xarray': lambda: decode.raster_to_xarray(raster),
+        'to_netcdf': lambda: grid.to_netcdf(None, engine='scipy'),
+        'zip': lambda: b''.join(archive.zip_chunks([('grid.nc', netcdf)])),
+    }
+
+def end_to_end(dataset: xr.Dataset, days: int) -> Callable[[], bytes]:
+    """Encodes, decodes and archives the dataset for each day like ingest followed by a getData download"""
+    def rasters() -> Iterator[Any]:
+        for day in range(days):
+            yield make_raster(dataset, START + timedelta(days=day))
+
+    def run() -> bytes:
+        grids = (decode.raster_to_xarray(raster) for raster in rasters())
+        return b''.join(archive.zip_chunks(netcdf_entries(grids)))
+    return run
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    """
+    Prints the change from the baseline and returns the benchmarks which are slower than the tolerance.
+    Benchmarks which are not in the baseline (e.g. new stages) are listed, so the baseline can be saved again.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<60} {'baseline [s]':>12} {'now [s]':>10} {'ratio':>7}")
+    for key, result in results.items():
+        if key not in baseline:
+            print(f"{key:<60} {'-':>12} {result['seconds']:>10.4f} {'new':>7}")
+            continue
+        ratio = result['seconds'] / baseline[key]['seconds']
+        print(f"{key:<60} {baseline[key]['seconds']:>12.4f} {result['seconds']:>10.4f} {ratio:>7.2f}")
+        if ratio > tolerance:
+            regressions.append(key)
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--resolutions', type=float, nargs='+', default=[1.0, 0.25, 0.1])
+    parser.add_argument('--dtypes', nargs='+', default=['float32', 'float64', 'int16'])
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 30], help="Day ranges of the end-to-end benchmark (e.g. 1 30 365)")
+    parser.add_argument('--end-to-end-resolutions', type=float, nargs='+', default=[1.0, 0.25])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--save', action='store_true', help="Save the results as the baseline")
+    parser.add_argument('--compare', action='store_true', help="Compare the results with the baseline")
+    parser.add_argument('--tolerance', type=float, default=1.25, help="Slowdown (ratio) which counts as a regression")
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, float]] = {}
+    print(f"{'benchmark':<60} {'time [s]':>10} {'MB/s':>10} {'peak [MB]':>10}")
+    for resolution in args.resolutions:
+        for dtype in args.dtypes:
+            dataset = make_grid(resolution, dtype)
+            benchmarks = {f"{name} {resolution} {dtype}": (function, 1) for name, function in stages(dataset).items()}
+            if resolution in args.end_to_end_resolutions:
+                for days in args.days:
+                    benchmarks[f"end_to_end {resolution} {dtype} {days}d"] = (end_to_end(dataset, days), days)
+            for key, (function, days) in benchmarks.items():
+                # Day ranges are only run once, since they can take minutes
+                seconds, peak = measure(function, args.repeats if days == 1 else 1)
+                throughput = dataset.nbytes * days / 1e6 / seconds
+                results[key] = {'seconds': seconds, 'mb_per_s': throughput, 'peak_mb': peak}
+                print(f"{key:<60} {seconds:>10.4f} {throughput:>10.1f} {peak:>10.1f}")
+
+    if args.compare:
+        if not args.baseline.exists():
+            sys.exit(f"No baseline in {args.baseline}, save one with --save on this machine first")
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        if regressions:
+            sys.exit(f"Slower than the baseline: {', '.join(regressions)}")
+    if args.save:
+        args.baseline.write_text(json.dumps(results, indent=2) + '\n')
+        print(f"Saved the baseline to {args.baseline}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import numpy as np
+import xarray as xr
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Sequence
+from shared_src.xarray_operations import encode
+from shared_src.xarray_operations.dtypes import BANDS
+
+def make_grid(resolution: float, dtype: str = 'float64', bands: Sequence[str] = BANDS, seed: int = 0) -> xr.Dataset:
+    """Makes a synthetic global grid (-80..80, -180..180) with the given resolution in degrees"""
+    lats = np.arange(-80 + resolution / 2, 80, resolution)
+    lons = np.arange(-180 + resolution / 2, 180, resolution)
+    rng = np.random.default_rng(seed)
+    return xr.Dataset(
+        data_vars={
+            name: (['lats', 'lons'], (rng.random((lats.size, lons.size)) * 100).astype(dtype)) for name in bands
+        },
+        coords=dict(lats=lats, lons=lons)
+    )
+
+def make_raster(dataset: xr.Dataset, day: datetime, wkb: bytes | None = None) -> SimpleNamespace:
+    """
+    Makes a grid row like the ones returned by the database (binary WKB and metadata) without a database.
+    An already encoded wkb of the dataset can be reused for many days.
+    """
+    return SimpleNamespace(
+        raster_wkb=bytes(encode.dataset_to_wkb(dataset, srid=4326)) if wkb is None else wkb,
+        date=day,
+        references='synthetic',
+        ellipsoid='WGS84',
+        ellipsoid_axis=6378137.0,
+        ellipsoid_flattening=1 / 298.257223563,
+        mission_names='synthetic',
+        mission_phase='synthetic',
+        rads='synthetic',
+        total_points=dataset.sizes['lats'] * dataset.sizes['lons'],
+        n_points='[]'
+    )
@@ -1,53 +1,148 @@
 import azure.functions as func
-from shared_src import GLOBAL_HEADERS, xarray_operations
+from shared_src import GLOBAL_HEADERS, xarray_operations, archive, cache, timing, exports, parallel
 import logging
-from typing import Any
-from datetime import datetime
-from shared_src.HandleInput import create_error_response, parse_input
+import heapq
+from itertools import chain
+import xarray as xr
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+from datetime import date
+from shared_src.HandleInput import (
+    create_error_response, parse_name, parse_date, parse_bounding_box, parse_variables, parse_option
+)
 from shared_src.databases import database
-import zipfile
-import io
+from shared_src.xarray_operations.netcdf import compressed_netcdf_entries, netcdf_file
 import base64
-
-from os import environ
+import json
 
 # Logging
 logging.getLogger(__name__)
 
-# Database
-DATABASE = database.Database(
-    username=environ["ALTIMETRY_USERNAME"],
-    password=environ["ALTIMETRY_PASSWORD"],
-    host=environ["ALTIMETRY_HOST"],
-    port=environ["ALTIMETRY_DATABASE_PORT"],
-    database_name=environ["ALTIMETRY_DATABASE"],
-    engine=environ["ALTIMETRY_DATABASE_CONNECTION_ENGINE"],
-    database_type=environ["ALTIMETRY_DATABASE_TYPE"],
-    create_tables=environ["ALTIMETRY_CREATE_TABLES"] == 'true'
-)
+ENCODINGS = ['binary', 'base64']
+FORMATS = ['daily', 'stacked']
+MODES = ['download', 'export']
+ARCHIVE_NAME = "AltimetryGridding.zip"
+
+def decode_grids(
+    resolution_id: int,
+    rasters: Iterable[Any],
+    variables: Optional[Sequence[str]],
+    versions: Dict[date, str]
+) -> Iterator[Tuple[date, xr.Dataset]]:
+    """Decodes one grid at a time and adds it to the grid cache with the version of its row"""
+    for raster in rasters:
+        grid = xarray_operations.raster_to_xarray(raster, variables)
+        day = cache.as_date(raster.date)
+        cache.GRIDS.put(resolution_id, day, grid, versions.get(day))
+        yield day, grid
+
+def cached_grids(
+    db: database.Database,
+    resolution_id: int,
+    start_date: date,
+    end_date: date,
+    variables: Optional[Sequence[str]],
+    skip_dates: Iterable[date] = ()
+) -> Iterator[xr.Dataset]:
+    """
+    Yields the grids ordered by date. Cached grids are reused and only the missing dates are fetched from the database.
+    The dates and versions are looked up first (without the rasters), so nothing is fetched when all the grids are cached.
+    Cached grids which were replaced or deleted (e.g. by an ingest outside the worker) are fetched again.
+    Grids on skip_dates are not yielded.
+    """
+    skip = set(map(cache.as_date, skip_dates))
+    rows = db.get_grid_versions(resolution_id, start_date, end_date)
+    versions = {cache.as_date(day): version for day, version in rows}
+    cached = cache.GRIDS.get_range(resolution_id, start_date, end_date, variables, versions)
+    available = [day for day, _ in rows if cache.as_date(day) not in skip]
+    cached = {day: cached[day] for day in map(cache.as_date, available) if day in cached}
+    missing = [day for day in available if cache.as_date(day) not in cached]
+    cache.GRIDS.add_hits(len(cached))
+    cache.GRIDS.add_misses(len(missing))
+    rasters = db.iter_grids_by_resolution_and_dates(
+        start_date=start_date,
+        end_date=end_date,
+        resolution_id=resolution_id,
+        variables=variables,
+        dates=missing
+    )
+    fetched = decode_grids(resolution_id, rasters, variables, versions)
+    for _, grid in heapq.merge(sorted(cached.items()), fetched, key=lambda item: item[0]):
+        yield grid
+
+def regional_entries(
+    db: database.Database,
+    resolution_id: int,
+    start_date: date,
+    end_date: date,
+    bbox: database.BoundingBox,
+    variables: Optional[Sequence[str]]
+) -> Iterator[archive.Compressed]:
+    """
+    Yields the grids clipped to the bounding box as compressed NetCDF files ordered by date.
+    Days stored as tiles are reassembled from the tiles intersecting the bounding box and the other days
+    are clipped in the database. Decoding, encoding and compressing runs in parallel for each day.
+    """
+    tile_dates = db.get_tile_dates(resolution_id, start_date, end_date)
+    dates = None
+    if tile_dates:
+        skip = set(tile_dates)
+        dates = [day for day in db.get_grid_dates(resolution_id, start_date, end_date) if day not in skip]
+    rasters = db.iter_grids_by_resolution_and_dates(
+        start_date=start_date,
+        end_date=end_date,
+        resolution_id=resolution_id,
+        bbox=bbox,
+        variables=variables,
+        dates=dates
+    )
+    if tile_dates:
+        # Tiled grids are (grid, tiles) pairs, which are merged with the clipped grids by date
+        tiled = db.iter_tiled_grids(start_date, end_date, resolution_id, bbox, variables)
+        rasters = heapq.merge(rasters, tiled, key=lambda item: item[0].date if isinstance(item, tuple) else item.date)
+
+    def encode(item: Any) -> archive.Compressed:
+        if isinstance(item, tuple):
+            raster, tiles = item
+            grid = xarray_operations.tiles_to_xarray(raster, tiles, variables, bbox)
+        else:
+            grid = xarray_operations.raster_to_xarray(item, variables)
+        return archive.compress(*netcdf_file(grid))
+    return parallel.ordered_map(encode, rasters)
 
-def parse_name(req: func.HttpRequest, param: str) -> func.HttpResponse | Any:
-    """Check and converts request object with param name to the correct type or response."""
-    # Get parameters and check them
-    if (out_name := parse_input(req, param)) is None:
-        return create_error_response(param, "has an invalid format", out_name, 400, "'string'")
-    if len(out_name) > 50:
-         return create_error_response(param, "is too long.", out_name, 400, "less than 50 characters")
-    if len(out_name) == 0:
-        return create_error_response(param, "is empty.", out_name, 400, "between 1-50 characters")
-    return out_name
-
-def parse_date(req: func.HttpRequest, param: str) -> func.HttpResponse | Any:
-    """Check and converts request object with param name to the correct type or response."""
-    # Get parameters and check them
-    if (date_str := parse_input(req, param)) is None:
-        return create_error_response(param, "has an invalid format", date_str, 400, "'YYYY-mm-dd'")
-    try:
-        return datetime.strptime(date_str, "%Y-%m-%d").date()
-    except ValueError:
-        return create_error_response(param, "has an invalid format", date_str, 400, "'YYYY-mm-dd'")
+def stacked_entries(rasters: Iterable[Any], count: int, variables: Optional[Sequence[str]], file_name: str) -> Iterator[Tuple[str, bytes | memoryview]]:
+    """
+    Decodes the grids into one dataset with a time dimension and yields it as a single NetCDF file (name, data).
+    count is the number of grids (see get_grid_dates), so each grid is decoded into the stacked arrays as it is streamed.
+    """
+    rasters = iter(rasters)
+    if count == 0 or (first := next(rasters, None)) is None:
+        return
+    with timing.measure("stack"):
+        grid = xarray_operations.rasters_to_stacked_xarray(chain([first], rasters), count, variables)
+    with timing.measure("netcdf") as measurement:
+        data = grid.to_netcdf(None, engine='scipy')
+        measurement.nbytes = len(data)
+    yield f"{file_name}.nc", data
+
+def export_response(request: exports.ExportRequest) -> func.HttpResponse:
+    """Queues an export job (or reuses an identical job) and responds with its status"""
+    status = exports.get_store().submit(request)
+    body = {"status": "success", **status, "status_url": f"/api/GetExport?job_id={status['job_id']}"}
+    return func.HttpResponse(json.dumps(body), status_code=202, headers=GLOBAL_HEADERS)
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
+    with timing.request() as timings:
+        response = get_data(req)
+    # Server-Timing can be read by the browser (and the client) for each stage of the request
+    response.headers["Server-Timing"] = timings.header()
+    response.headers["Timing-Allow-Origin"] = "*"
+    exposed = response.headers.get("Access-Control-Expose-Headers")
+    response.headers["Access-Control-Expose-Headers"] = "Server-Timing" if exposed is None else f"{exposed}, Server-Timing"
+    timings.log("getData")
+    return response
+
+def get_data(req: func.HttpRequest) -> func.HttpResponse:
+    DATABASE = database.get_database()
     logging.info(f"Requesting data")
     # Resolution name
     if isinstance((resolution := parse_name(req, 'resolution_name')), func.HttpResponse):
@@ -64,23 +159,84 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     # End date
     if isinstance((end_date := parse_date(req, 'end_date')), func.HttpResponse):
         return end_date
-    logging.info(f"Requesting data {resolution}, {product}, {start_date}, {end_date}")
-    rasters = DATABASE.get_grids_by_resolution_and_dates(
-        start_date=start_date,
-        end_date=end_date,
-        resolution_name=resolution # type: ignore
-    )
-    
-    if rasters is None:
+
+    # Bounding box
+    if isinstance((bbox := parse_bounding_box(req)), func.HttpResponse):
+        return bbox
+
+    # Variables
+    if isinstance((variables := parse_variables(req, 'variables')), func.HttpResponse):
+        return variables
+
+    # Response encoding (base64 is kept for old clients)
+    if isinstance((encoding := parse_option(req, 'encoding', ENCODINGS)), func.HttpResponse):
+        return encoding
+
+    # Output format (one NetCDF file per day or one NetCDF file with a time dimension)
+    if isinstance((output_format := parse_option(req, 'format', FORMATS)), func.HttpResponse):
+        return output_format
+
+    # Mode (export builds the archive in a worker, which is used for long date ranges)
+    if isinstance((mode := parse_option(req, 'mode', MODES)), func.HttpResponse):
+        return mode
+    if mode == 'export' and output_format != 'daily':
+        return create_error_response('format', "is not supported by exports", output_format, 400, "daily")
+    logging.info(f"Requesting data {resolution}, {product}, {start_date}, {end_date}, {bbox}, {variables}")
+    if (resolution_row := DATABASE.get_resolutions_by_name(resolution)) is None:
         return create_error_response('resolution', "did not exist in the database", resolution, 400, None)
-    grids = [xarray_operations.raster_to_xarray(raster) for raster in rasters]
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
-        for grid in grids:
-            file_name = str(grid.time.data).split('T')[0]
-            zip_file.writestr(f"{file_name}.nc", grid.to_netcdf(None, engine='scipy'))
+
+    if mode == 'export':
+        return export_response(exports.ExportRequest(
+            resolution_id=resolution_row.id,
+            resolution_name=resolution,
+            start_date=start_date,
+            end_date=end_date,
+            variables=variables,
+            bbox=None if bbox is None else list(bbox)
+        ))
+
+    # Stream grids from the database through the NetCDF encoder into the zip archive a few grids at a time
+    if output_format == 'stacked':
+        dates = DATABASE.get_grid_dates(resolution_row.id, start_date, end_date)
+        rasters = DATABASE.iter_grids_by_resolution_and_dates(
+            start_date=start_date,
+            end_date=end_date,
+            resolution_id=resolution_row.id,
+            bbox=bbox,
+            variables=variables,
+            dates=dates
+        )
+        entries = stacked_entries(rasters, len(dates), variables, f"{start_date}_{end_date}")
+    elif bbox is None:
+        # Precomputed NetCDF files are copied into the archive as they are and only the other days are encoded
+        artifact_dates = DATABASE.get_artifact_dates(resolution_row.id, start_date, end_date, variables)
+        artifacts = DATABASE.iter_grid_artifacts(start_date, end_date, resolution_row.id, variables) if artifact_dates else iter(())
+        # The other days are encoded and compressed in parallel (decoding is cheap compared to encoding)
+        encoded = compressed_netcdf_entries(cached_grids(DATABASE, resolution_row.id, start_date, end_date, variables, artifact_dates))
+        # The file names are the dates, so merging on the name keeps the files ordered by date
+        entries = heapq.merge(artifacts, encoded, key=lambda entry: entry[0])
+    else:
+        entries = regional_entries(DATABASE, resolution_row.id, start_date, end_date, bbox, variables)
+    chunks = archive.zip_chunks(entries)
+    # The http output binding needs the whole body, so only the compressed archive is kept in memory
+    body = b"".join(chunks)
+    logging.info(f"Grid cache {cache.GRIDS.stats()}")
+    logging.info(f"Database pool {DATABASE.pool_stats()}")
+    if encoding == 'base64':
+        with timing.measure("base64", len(body)):
+            body = base64.b64encode(body)
+        return func.HttpResponse(
+            body,
+            status_code = 200,
+            headers=GLOBAL_HEADERS
+        )
     return func.HttpResponse(
-        base64.b64encode(zip_buffer.getvalue()),
+        body,
         status_code = 200,
-        headers=GLOBAL_HEADERS
+        mimetype="application/zip",
+        headers={
+            **GLOBAL_HEADERS,
+            "Content-Disposition": f'attachment; filename="{ARCHIVE_NAME}"',
+            "Access-Control-Expose-Headers": "Content-Disposition"
+        }
     )
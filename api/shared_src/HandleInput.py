@@ -1,8 +1,14 @@
 import azure.functions as func
-from typing import Any, Optional
+from typing import Any, List, Optional, Hashable, Callable, TYPE_CHECKING
+from datetime import datetime
+from . import cache
+from .xarray_operations.dtypes import BANDS
 import logging
 import json
 
+if TYPE_CHECKING:
+    from .databases.database import BoundingBox
+
 logger = logging.getLogger(__name__)
 
 GLOBAL_HEADERS = {
@@ -40,4 +46,101 @@ def parse_login(req: func.HttpRequest, database: Any) -> bool:
         logging.info("User logged in")
     else:
         logging.error(f"Username or password was incorrect")
-    return status
\ No newline at end of file
+    return status
+
+def not_modified(req: func.HttpRequest, etag: str) -> bool:
+    """ Check if the client already has the response with the etag"""
+    if (if_none_match := req.headers.get('If-None-Match')) is None:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+def catalogue_response(req: func.HttpRequest, key: Hashable, make_body: Callable[[], Any | func.HttpResponse]) -> func.HttpResponse:
+    """ Responds with a cached catalogue response (ETag and Cache-Control). make_body is only called if the response is not cached.
+    If make_body returns a response it is returned without caching it"""
+    if (cached := cache.CATALOGUE.get(key)) is None:
+        if isinstance((body := make_body()), func.HttpResponse):
+            return body
+        cached = cache.CATALOGUE.put(key, json.dumps(body))
+    etag, body = cached
+    headers = {
+        **GLOBAL_HEADERS,
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={cache.CATALOGUE.max_age}",
+        "Access-Control-Expose-Headers": "ETag"
+    }
+    if not_modified(req, etag):
+        return func.HttpResponse(status_code=304, headers=headers)
+    return func.HttpResponse(body, status_code=200, headers=headers)
+
+def parse_name(req: func.HttpRequest, param: str) -> func.HttpResponse | Any:
+    """Check and converts request object with param name to the correct type or response."""
+    # Get parameters and check them
+    if (out_name := parse_input(req, param)) is None:
+        return create_error_response(param, "has an invalid format", out_name, 400, "'string'")
+    if len(out_name) > 50:
+         return create_error_response(param, "is too long.", out_name, 400, "less than 50 characters")
+    if len(out_name) == 0:
+        return create_error_response(param, "is empty.", out_name, 400, "between 1-50 characters")
+    return out_name
+
+def parse_date(req: func.HttpRequest, param: str) -> func.HttpResponse | Any:
+    """Check and converts request object with param name to the correct type or response."""
+    # Get parameters and check them
+    if (date_str := parse_input(req, param)) is None:
+        return create_error_response(param, "has an invalid format", date_str, 400, "'YYYY-mm-dd'")
+    try:
+        return datetime.strptime(date_str, "%Y-%m-%d").date()
+    except ValueError:
+        return create_error_response(param, "has an invalid format", date_str, 400, "'YYYY-mm-dd'")
+
+def parse_float(req: func.HttpRequest, param: str) -> func.HttpResponse | float | None:
+    """Check and converts optional request object with param name to a float or response."""
+    if (value := parse_input(req, param)) is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return create_error_response(param, "has an invalid format", value, 400, "'float'")
+
+def parse_bounding_box(req: func.HttpRequest) -> "func.HttpResponse | BoundingBox | None":
+    """Check and converts the optional bounding box (min_lat, max_lat, min_lon and max_lon) to the correct type or response."""
+    from .databases.database import BoundingBox
+    values = []
+    for param in BoundingBox._fields:
+        if isinstance((value := parse_float(req, param)), func.HttpResponse):
+            return value
+        values.append(value)
+    if all(value is None for value in values):
+        return None
+    fields = ", ".join(BoundingBox._fields)
+    if any(value is None for value in values):
+        return create_error_response(fields, "has to be given together", values, 400, None)
+    bbox = BoundingBox(*values)
+    if not -90 <= bbox.min_lat < bbox.max_lat <= 90:
+        return create_error_response("min_lat and max_lat", "is not a valid range", (bbox.min_lat, bbox.max_lat), 400, "-90 <= min_lat < max_lat <= 90")
+    if not -180 <= bbox.min_lon < bbox.max_lon <= 180:
+        return create_error_response("min_lon and max_lon", "is not a valid range", (bbox.min_lon, bbox.max_lon), 400, "-180 <= min_lon < max_lon <= 180")
+    return bbox
+
+def parse_variables(req: func.HttpRequest, param: str) -> func.HttpResponse | List[str] | None:
+    """Check and converts the optional list of variables (comma separated or a list) to the correct type or response."""
+    if (variables := parse_input(req, param)) is None:
+        return None
+    if isinstance(variables, str):
+        variables = variables.split(',')
+    if not isinstance(variables, list) or any(not isinstance(name, str) for name in variables):
+        return create_error_response(param, "has an invalid format", variables, 400, "comma separated string or list of strings")
+    names = {name.strip() for name in variables}
+    if len(names) == 0 or not names.issubset(BANDS):
+        return create_error_response(param, "has invalid variables", variables, 400, ", ".join(BANDS))
+    # Keep the order of the bands in the raster
+    return [name for name in BANDS if name in names]
+
+def parse_option(req: func.HttpRequest, param: str, options: List[str]) -> func.HttpResponse | str:
+    """Check and converts the optional request object with param name to one of the options or response (default is the first option)."""
+    if (value := parse_input(req, param)) is None:
+        return options[0]
+    if value not in options:
+        return create_error_response(param, "has an invalid format", value, 400, " or ".join(options))
+    return value
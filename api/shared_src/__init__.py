@@ -1,3 +1,15 @@
-from . import HandleInput, xarray_operations, databases
+from importlib import import_module
+from typing import Any, TYPE_CHECKING
 from .HandleInput import GLOBAL_HEADERS
 
+# Each function only imports the parts of shared_src it uses, which keeps the cold start short
+if TYPE_CHECKING:
+    from . import HandleInput, xarray_operations, databases, archive, cache, timing, exports, parallel
+
+_SUBMODULES = ['HandleInput', 'xarray_operations', 'databases', 'archive', 'cache', 'timing', 'exports', 'parallel']
+
+def __getattr__(name: str) -> Any:
+    """Imports the submodules on first access"""
+    if name in _SUBMODULES:
+        return import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
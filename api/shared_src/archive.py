@@ -0,0 +1,162 @@
+import struct
+import time
+import zlib
+from typing import Iterable, Iterator, List, NamedTuple, Tuple
+from . import timing
+
+# Zip format (https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT)
+LOCAL_FILE_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_DIRECTORY_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+ZIP64_END_OF_CENTRAL_DIRECTORY = struct.Struct('<IQHHIIQQQQ')
+ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR = struct.Struct('<IIQI')
+END_OF_CENTRAL_DIRECTORY = struct.Struct('<IHHHHIIH')
+ZIP64_EXTRA_HEADER = struct.Struct('<HH')
+
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP32_COUNT_LIMIT = 0xFFFF
+UTF8_FLAG = 0x800
+DEFLATED = 8
+VERSION = 20
+VERSION_ZIP64 = 45
+
+class ZipEntry(NamedTuple):
+    """Central directory information of an entry in the archive"""
+    name: bytes
+    crc: int
+    compressed_size: int
+    size: int
+    offset: int
+    dos_time: int
+    dos_date: int
+
+class Compressed(NamedTuple):
+    """Data of an entry which is already compressed with raw deflate"""
+    name: str
+    data: bytes
+    crc: int
+    size: int
+
+def compress(name: str, data: bytes | memoryview, compresslevel: int = 6) -> Compressed:
+    """Compresses the data of an entry, so it can be stored and added to archives later"""
+    with timing.measure("deflate") as measurement:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        measurement.nbytes = len(compressed)
+    return Compressed(name, compressed, zlib.crc32(data), len(data))
+
+def dos_date_time(timestamp: float) -> Tuple[int, int]:
+    """Converts a timestamp to the (time, date) format used in zip archives"""
+    year, month, day, hour, minute, second = time.localtime(timestamp)[:6]
+    return (hour << 11) | (minute << 5) | (second // 2), ((max(year, 1980) - 1980) << 9) | (month << 5) | day
+
+def zip64_extra(*values: int) -> bytes:
+    """Zip64 extended information extra field for the values that do not fit in 32 bits"""
+    if len(values) == 0:
+        return b''
+    return ZIP64_EXTRA_HEADER.pack(0x0001, 8 * len(values)) + struct.pack(f'<{len(values)}Q', *values)
+
+class ZipStream:
+    """
+    Writes a zip archive as a stream of chunks.
+    Each entry is compressed and emitted as soon as it is added, so only one entry is held in memory.
+    Zip64 records are only written when sizes, offsets or the number of entries need them.
+    """
+    def __init__(self, compresslevel: int = 6) -> None:
+        self.compresslevel = compresslevel
+        self._entries: List[ZipEntry] = []
+        self._offset = 0
+
+    def _emit(self, chunk: bytes) -> bytes:
+        """Keeps track of the position in the archive"""
+        self._offset += len(chunk)
+        return chunk
+
+    def add(self, name: str, data: bytes | memoryview) -> Iterator[bytes]:
+        """Compresses data and yields the entry with the name"""
+        yield from self.add_compressed(*compress(name, data, self.compresslevel))
+
+    def add_compressed(self, name: str, compressed: bytes, crc: int, size: int) -> Iterator[bytes]:
+        """Yields an entry with data which is already compressed with raw deflate"""
+        encoded_name = name.encode()
+        dos_time, dos_date = dos_date_time(time.time())
+        entry = ZipEntry(encoded_name, crc, len(compressed), size, self._offset, dos_time, dos_date)
+        zip64 = entry.size >= ZIP32_LIMIT or entry.compressed_size >= ZIP32_LIMIT
+        extra = zip64_extra(entry.size, entry.compressed_size) if zip64 else b''
+        header = LOCAL_FILE_HEADER.pack(
+            0x04034b50,
+            VERSION_ZIP64 if zip64 else VERSION,
+            UTF8_FLAG,
+            DEFLATED,
+            dos_time,
+            dos_date,
+            crc,
+            ZIP32_LIMIT if zip64 else entry.compressed_size,
+            ZIP32_LIMIT if zip64 else entry.size,
+            len(encoded_name),
+            len(extra)
+        )
+        self._entries.append(entry)
+        yield self._emit(header + encoded_name + extra)
+        yield self._emit(compressed)
+
+    def close(self) -> Iterator[bytes]:
+        """Yields the central directory which ends the archive"""
+        start = self._offset
+        for entry in self._entries:
+            yield self._emit(self._central_directory_header(entry))
+        end = self._offset
+        size = end - start
+        count = len(self._entries)
+        if count >= ZIP32_COUNT_LIMIT or size >= ZIP32_LIMIT or start >= ZIP32_LIMIT:
+            yield self._emit(ZIP64_END_OF_CENTRAL_DIRECTORY.pack(
+                0x06064b50, ZIP64_END_OF_CENTRAL_DIRECTORY.size - 12, VERSION_ZIP64, VERSION_ZIP64,
+                0, 0, count, count, size, start
+            ))
+            yield self._emit(ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR.pack(0x07064b50, 0, end, 1))
+        yield self._emit(END_OF_CENTRAL_DIRECTORY.pack(
+            0x06054b50, 0, 0,
+            min(count, ZIP32_COUNT_LIMIT), min(count, ZIP32_COUNT_LIMIT),
+            min(size, ZIP32_LIMIT), min(start, ZIP32_LIMIT),
+            0
+        ))
+
+    @staticmethod
+    def _central_directory_header(entry: ZipEntry) -> bytes:
+        """Central directory header of an entry"""
+        # Only the values which do not fit are stored in the zip64 extra field (in this order)
+        large = [value for value in (entry.size, entry.compressed_size, entry.offset) if value >= ZIP32_LIMIT]
+        extra = zip64_extra(*large)
+        version = VERSION_ZIP64 if large else VERSION
+        header = CENTRAL_DIRECTORY_HEADER.pack(
+            0x02014b50,
+            version, # Made by
+            version, # Needed to extract
+            UTF8_FLAG,
+            DEFLATED,
+            entry.dos_time,
+            entry.dos_date,
+            entry.crc,
+            min(entry.compressed_size, ZIP32_LIMIT),
+            min(entry.size, ZIP32_LIMIT),
+            len(entry.name),
+            len(extra),
+            0, # Comment length
+            0, # Disk number
+            0, # Internal attributes
+            0o600 << 16, # External attributes (permissions)
+            min(entry.offset, ZIP32_LIMIT)
+        )
+        return header + entry.name + extra
+
+def zip_chunks(entries: Iterable[Tuple[str, bytes | memoryview] | Compressed], compresslevel: int = 6) -> Iterator[bytes]:
+    """
+    Streams (name, data) entries into a zip archive and yields the archive in chunks.
+    Compressed entries are copied into the archive without compressing them again.
+    """
+    archive = ZipStream(compresslevel)
+    for entry in entries:
+        if isinstance(entry, Compressed):
+            yield from archive.add_compressed(*entry)
+        else:
+            yield from archive.add(*entry)
+    yield from archive.close()
@@ -0,0 +1,194 @@
+from collections import OrderedDict
+from datetime import date, datetime
+from os import environ
+from typing import Dict, Hashable, Optional, Sequence, Tuple, TYPE_CHECKING
+import hashlib
+import logging
+import threading
+import time
+from .xarray_operations.dtypes import BANDS
+
+if TYPE_CHECKING:
+    import xarray as xr
+
+logging.getLogger(__name__)
+
+def as_date(day: date | datetime) -> date:
+    """Grids are stored with a timestamp, but they are cached per day"""
+    return day.date() if isinstance(day, datetime) else day
+
+class GridCache:
+    """
+    Memory bounded LRU cache of decoded grids keyed by (resolution_id, date).
+    The cache lives in the worker process, so it is kept between warm invocations.
+    Grids are ingested outside the workers, so each grid is stored with the version of its row (see Database.get_grid_versions)
+    and get_range drops grids whose version changed. Grids also expire after max_age seconds.
+    """
+    def __init__(self, max_bytes: int, max_age: float = float('inf')) -> None:
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._grids: OrderedDict[Tuple[int, date], Tuple[float, Optional[str], "xr.Dataset"]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, added: float) -> bool:
+        """Checks if a grid added at the monotonic time added is too old to be used"""
+        return time.monotonic() - added > self.max_age
+
+    def _remove(self, key: Tuple[int, date]) -> None:
+        """Removes a grid (the lock must be held)"""
+        if (entry := self._grids.pop(key, None)) is not None:
+            self.size -= entry[2].nbytes
+
+    @staticmethod
+    def _has_variables(grid: "xr.Dataset", variables: Optional[Sequence[str]]) -> bool:
+        """Checks if a cached grid has all the variables (None is all the bands)"""
+        return set(variables or BANDS).issubset(grid.data_vars)
+
+    def get(self, resolution_id: int, day: date | datetime, variables: Optional[Sequence[str]] = None) -> "xr.Dataset | None":
+        """Gets a grid if it is cached with all the variables (None is all the bands)"""
+        key = (resolution_id, as_date(day))
+        with self._lock:
+            entry = self._grids.get(key)
+            if entry is not None and self._expired(entry[0]):
+                self._remove(key)
+                entry = None
+            if entry is None or not self._has_variables(entry[2], variables):
+                self.misses += 1
+                return None
+            grid = entry[2]
+            self._grids.move_to_end(key)
+            self.hits += 1
+        return grid if variables is None else grid[list(variables)]
+
+    def get_range(
+        self,
+        resolution_id: int,
+        start_date: date,
+        end_date: date,
+        variables: Optional[Sequence[str]] = None,
+        versions: Optional[Dict[date, str]] = None
+    ) -> Dict[date, "xr.Dataset"]:
+        """
+        Gets all cached grids of a resolution between two dates (both included) with all the variables (None is all the bands).
+        If versions (the current version of the grid of each date) is given, grids with another version or
+        on dates which are not in versions are removed, since they were replaced or deleted.
+        Hits and misses are not counted, since the caller decides which grids are used (see add_hits and add_misses).
+        """
+        with self._lock:
+            entries = {
+                day: entry for (res_id, day), entry in self._grids.items()
+                if res_id == resolution_id and start_date <= day <= end_date
+            }
+            for day, (added, version, _) in entries.items():
+                if self._expired(added) or (versions is not None and versions.get(day) != version):
+                    self._remove((resolution_id, day))
+            grids = {
+                day: grid for day, (_, _, grid) in entries.items()
+                if (resolution_id, day) in self._grids and self._has_variables(grid, variables)
+            }
+            for day in grids:
+                self._grids.move_to_end((resolution_id, day))
+        if variables is None:
+            return grids
+        return {day: grid[list(variables)] for day, grid in grids.items()}
+
+    def add_hits(self, count: int = 1) -> None:
+        """Counts cached grids which were used"""
+        with self._lock:
+            self.hits += count
+
+    def add_misses(self, count: int = 1) -> None:
+        """Counts grids which had to be fetched from the database"""
+        with self._lock:
+            self.misses += count
+
+    def put(self, resolution_id: int, day: date | datetime, grid: "xr.Dataset", version: Optional[str] = None) -> None:
+        """Adds a grid with the version of its row and evicts the least recently used grids until the cache fits in max_bytes"""
+        if grid.nbytes > self.max_bytes:
+            return
+        key = (resolution_id, as_date(day))
+        with self._lock:
+            self._remove(key)
+            self._grids[key] = (time.monotonic(), version, grid)
+            self.size += grid.nbytes
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self._grids.popitem(last=False)
+                self.size -= evicted.nbytes
+                self.evictions += 1
+
+    def invalidate(self, resolution_id: int, day: Optional[date | datetime] = None) -> None:
+        """Removes a grid or all grids of a resolution if day is None"""
+        with self._lock:
+            if day is not None:
+                keys = [(resolution_id, as_date(day))]
+            else:
+                keys = [key for key in self._grids if key[0] == resolution_id]
+            for key in keys:
+                self._remove(key)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of the cache"""
+        return {
+            "grids": len(self._grids),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+class CatalogueCache:
+    """
+    Cache of the catalogue (products, resolutions and available dates) responses with an ETag for each response.
+    The version is bumped when products or resolutions are created or deleted, which clears the cache.
+    Responses of a kind (e.g. the available dates, which are keyed by the name of the resolution) can be invalidated when grids change.
+    Responses also expire after max_age seconds, since other workers can change the catalogue.
+    """
+    def __init__(self, max_age: int) -> None:
+        self.max_age = max_age
+        self.version = 0
+        self._responses: Dict[Hashable, Tuple[float, str, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Tuple[str, str] | None:
+        """Gets the (etag, body) of a response if it has not expired"""
+        with self._lock:
+            response = self._responses.get(key)
+        if response is None or time.monotonic() - response[0] > self.max_age:
+            return None
+        return response[1], response[2]
+
+    def put(self, key: Hashable, body: str) -> Tuple[str, str]:
+        """Adds a response and returns its (etag, body). The ETag is the hash of the body"""
+        etag = f'"{hashlib.sha1(body.encode()).hexdigest()}"'
+        with self._lock:
+            self._responses[key] = (time.monotonic(), etag, body)
+        return etag, body
+
+    def invalidate(self, key: Hashable) -> None:
+        """Removes a single response"""
+        with self._lock:
+            self._responses.pop(key, None)
+
+    def invalidate_kind(self, kind: str) -> None:
+        """Removes the responses with keys (kind, ...), e.g. the available dates of all resolutions"""
+        with self._lock:
+            for key in [key for key in self._responses if isinstance(key, tuple) and key[:1] == (kind,)]:
+                del self._responses[key]
+
+    def bump(self) -> None:
+        """Marks the catalogue as changed"""
+        with self._lock:
+            self.version += 1
+            self._responses.clear()
+        logging.info(f"Catalogue version {self.version}")
+
+GRIDS = GridCache(
+    int(environ.get("ALTIMETRY_GRID_CACHE_MB", 256)) * 1024 ** 2,
+    int(environ.get("ALTIMETRY_GRID_CACHE_MAX_AGE", 3600))
+)
+CATALOGUE = CatalogueCache(int(environ.get("ALTIMETRY_CATALOGUE_MAX_AGE", 300)))
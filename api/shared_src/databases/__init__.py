@@ -1,2 +1,2 @@
-from .database import Database as Database
-from . import tables as tables
\ No newline at end of file
+from .database import Database as Database, BoundingBox as BoundingBox, Polygon as Polygon, PoolSettings as PoolSettings, get_database as get_database
+from . import tables as tables
@@ -0,0 +1,22 @@
+"""
+One-off setup of the database: creates the tables and adds the default user (DEFAULT_USERNAME/DEFAULT_PASSWORD).
+Needs the ALTIMETRY_* environment variables and SALT.
+Run from the api folder: python -m shared_src.databases.bootstrap
+With --rebuild-artifacts the stored NetCDF files are remade from their grids (see Database.rebuild_artifacts).
+"""
+import argparse
+import logging
+from .database import get_database
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rebuild-artifacts', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    database = get_database()
+    database.bootstrap()
+    if args.rebuild_artifacts:
+        database.rebuild_artifacts()
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,129 @@
-
-from sqlalchemy import create_engine, select, Row
-from sqlalchemy.orm import sessionmaker, InstrumentedAttribute
-from typing import Sequence, Optional, Tuple, Any, List, Dict
+from sqlalchemy import create_engine, select, delete, tuple_, true, literal_column, Double, Row, Select, func
+from sqlalchemy.dialects.postgresql import array
+from sqlalchemy.orm import sessionmaker, InstrumentedAttribute, defer, with_expression
+from typing import Sequence, Optional, Tuple, Any, List, Dict, Iterable, Iterator, NamedTuple, TYPE_CHECKING
 from os import environ
 from . import tables
+from .pool import TimedQueuePool
+from itertools import chain, groupby
+import json
 import logging
-from datetime import date
-import xarray as xr
-from ..xarray_operations import encode
+import math
+from datetime import date, datetime
+from ..xarray_operations import BANDS
+from ..xarray_operations.dtypes import RASTER_LAYOUT
+from .. import cache, exports, timing
+import threading
 logging.getLogger(__name__)
 
+if TYPE_CHECKING:
+    import xarray as xr
+    from .. import archive
+
+class BoundingBox(NamedTuple):
+    """Region of a grid in degrees"""
+    min_lat: float
+    max_lat: float
+    min_lon: float
+    max_lon: float
+
+    def envelope(self, srid: int = 4326) -> Any:
+        """
+        Envelope of the bounding box in the coordinates of the rasters.
+        The first dimension of the dataset (latitude) is encoded along the x-axis of the raster (see encode).
+        """
+        return func.ST_MakeEnvelope(self.min_lat, self.min_lon, self.max_lat, self.max_lon, srid)
+
+    def geometry(self, srid: int = 4326) -> Any:
+        """Geometry of the region in the coordinates of the rasters (see Polygon)"""
+        return self.envelope(srid)
+
+class Polygon(NamedTuple):
+    """Region of a grid as (lat, lon) vertices in degrees. The polygon is closed automatically"""
+    points: Tuple[Tuple[float, float], ...]
+
+    def geometry(self, srid: int = 4326) -> Any:
+        """Geometry of the polygon in the coordinates of the rasters (latitude along the x-axis, see BoundingBox.envelope)"""
+        ring = [*self.points, self.points[0]]
+        return func.ST_GeomFromText(f"POLYGON(({', '.join(f'{lat} {lon}' for lat, lon in ring)}))", srid)
+
+class PoolSettings(NamedTuple):
+    """Settings of the connection pool of a database"""
+    size: int = 5
+    max_overflow: int = 10
+    # Seconds to wait for a connection before failing
+    timeout: float = 30
+    # Connections older than recycle seconds are replaced (-1 never replaces them)
+    recycle: int = 1800
+    # Tests connections before they are used, which replaces connections closed while the worker was idle
+    pre_ping: bool = True
+    # Statements running longer are cancelled by the database (0 disables the timeout)
+    statement_timeout_ms: int = 0
+    # Checkouts waiting longer for a connection are logged
+    slow_checkout_ms: float = 100
+
+    @classmethod
+    def from_environ(cls) -> "PoolSettings":
+        """Settings from the ALTIMETRY_POOL_* and ALTIMETRY_STATEMENT_TIMEOUT_MS environment variables"""
+        default = cls()
+        return cls(
+            size=int(environ.get("ALTIMETRY_POOL_SIZE", default.size)),
+            max_overflow=int(environ.get("ALTIMETRY_POOL_MAX_OVERFLOW", default.max_overflow)),
+            timeout=float(environ.get("ALTIMETRY_POOL_TIMEOUT", default.timeout)),
+            recycle=int(environ.get("ALTIMETRY_POOL_RECYCLE", default.recycle)),
+            pre_ping=environ.get("ALTIMETRY_POOL_PRE_PING", str(default.pre_ping)).lower() == 'true',
+            statement_timeout_ms=int(environ.get("ALTIMETRY_STATEMENT_TIMEOUT_MS", default.statement_timeout_ms)),
+            slow_checkout_ms=float(environ.get("ALTIMETRY_POOL_SLOW_CHECKOUT_MS", default.slow_checkout_ms))
+        )
+
 class Database:
-    def __init__(self, username: str, password: str, host: str, port: str | int, database_name: str, engine: str, database_type: str, create_tables: bool = True) -> None:
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        host: str,
+        port: str | int,
+        database_name: str,
+        engine: str,
+        database_type: str,
+        pool: PoolSettings = PoolSettings()
+    ) -> None:
         self._url_object = f"{database_type}+{engine}://{username}:{password}@{host}:{port}/{database_name}?sslmode=require"
-        self.engine = create_engine(self._url_object)
+        connect_args = {}
+        if pool.statement_timeout_ms > 0:
+            connect_args["options"] = f"-c statement_timeout={pool.statement_timeout_ms}"
+        self.engine = create_engine(
+            self._url_object,
+            poolclass=TimedQueuePool,
+            pool_size=pool.size,
+            max_overflow=pool.max_overflow,
+            pool_timeout=pool.timeout,
+            pool_recycle=pool.recycle,
+            pool_pre_ping=pool.pre_ping,
+            connect_args=connect_args
+        )
+        # create_engine does not pass extra arguments to the pool, so the threshold is set afterwards
+        if isinstance(self.engine.pool, TimedQueuePool):
+            self.engine.pool.slow_checkout_ms = pool.slow_checkout_ms
+        timing.instrument_engine(self.engine)
         self.session = sessionmaker(self.engine)
-        if create_tables:
-            tables.create_all_tables(self.engine)
+
+    def pool_stats(self) -> Dict[str, float]:
+        """Checkout wait times and usage of the connection pool"""
+        pool = self.engine.pool
+        return pool.stats() if isinstance(pool, TimedQueuePool) else {}
+
+    def bootstrap(self) -> None:
+        """
+        Creates the tables if they dont exists and adds the default user (DEFAULT_USERNAME/DEFAULT_PASSWORD).
+        This is a one-off step when the database is setup (see bootstrap.py) and is not done by the functions.
+        """
+        tables.create_all_tables(self.engine)
+        # Grid.upsert replaces grids on conflict of the unique (resolution_id, date) index
+        tables.migrate_grid_index(self.engine)
+        tables.migrate_grid_scales(self.engine)
+        if (rewritten := tables.migrate_raster_layout(self.engine)) > 0:
+            logging.info(f"Rewrote {rewritten} rasters in the order of PostGIS")
         user_username = environ.get("DEFAULT_USERNAME")
         user_password = environ.get("DEFAULT_PASSWORD")
         if user_username is not None and user_password is not None:
@@ -37,6 +144,7 @@ class Database:
         name = product.name
         if self.check_add(product, name=name):
             logging.info(f"Adding {name} to the product table")
+            cache.CATALOGUE.bump()
             return True
         logging.warning(f"{name} already existed in the product table")
         return False
@@ -64,34 +172,23 @@ class Database:
         # Add resolution
         if self.check_add(resolution, name=resolution.name):
             logging.info(f"Added {name} to the resolution table")
+            cache.CATALOGUE.bump()
             return True, f"success"
         logging.warning(f"{name} already existed in the resolution table")
         return False, f"{name} already exists"
 
-    def _construct_grid(self, grid: tables.Grid) -> bool:
-        """Adds a grid to the database"""
-        resolution_id = grid.resolution_id
-        with self.session(expire_on_commit=False) as session, session.begin():
-            # Check resolution exists
-            resolution_exists = select(tables.Resolution.id).filter_by(id=grid.resolution_id)
-            if session.scalars(resolution_exists).first() is None:
-                logging.warning(f"No resolution matched resolution_id {resolution_id}. Did not add grid to the grid table.")
-                return False
-            grid.insert(session)
-        # Add grid
-        if self.check_add(grid, expire_on_commit=False):
-            logging.info(f"Added grid to the grid table")
-            return True
-        logging.warning(f"Failed to add grid to the grid table")
-        return False
-
-    def _add_grid_id(self, dataset: xr.Dataset, day: date, resolution_id: int, srid: int = 4326) -> bool:
-        """Adds a grid to the database"""
-        # Make grid
-        hexwkb = encode.dataset_to_hexwkb(dataset, srid=srid)
-        strhexwkb = str(hexwkb)[2:-1] # remove b''
-        grid = tables.Grid(
-            raster=strhexwkb,
+    @staticmethod
+    def _grid_values(dataset: "xr.Dataset", day: date, resolution_id: int, srid: int = 4326) -> Dict[str, Any]:
+        """
+        Encodes the dataset and gets the values of the grid table columns.
+        The scales of packed bands (see encode.pack_dataset) are stored with the grid.
+        """
+        from ..xarray_operations import encode
+        scales = encode.packing_attributes(dataset)
+        return dict(
+            raster=encode.dataset_to_wkb(dataset, srid=srid),
+            scales=json.dumps(scales) if scales else None,
+            layout=RASTER_LAYOUT,
             date=day,
             references=str(dataset['z'].attrs.get('references')),
             ellipsoid=str(dataset['z'].attrs.get('ellipsoid')),
@@ -104,16 +201,197 @@ class Database:
             n_points=str(list(dataset['z'].attrs.get('n_points', ''))),
             resolution_id=resolution_id
         )
-        if(not self._construct_grid(grid)):
-            return False
-        return True
 
-    def add_grid(self, dataset: xr.Dataset, day: date, resolution: int | tables.Resolution) -> bool:
-        """Adds a grid to the database"""
-        if isinstance(resolution, int):
-            status = self._add_grid_id(dataset, day, resolution)
-        else:
-            status = self._add_grid_id(dataset, day, resolution.id)
+    @staticmethod
+    def _tile_values(dataset: "xr.Dataset", day: date, resolution_id: int, tile_size: int, srid: int = 4326) -> List[Dict[str, Any]]:
+        """Splits the dataset into tiles (see encode.tile_dataset) and gets the values of the grid_tile table columns"""
+        from ..xarray_operations import encode
+        return [
+            dict(
+                raster=encode.dataset_to_wkb(tile, srid=srid, geotransform=geotransform),
+                date=day,
+                tile_row=row,
+                tile_column=column,
+                resolution_id=resolution_id,
+                layout=RASTER_LAYOUT
+            )
+            for row, column, tile, geotransform in encode.tile_dataset(dataset, tile_size)
+        ]
+
+    @classmethod
+    def _artifact_bands(cls, variables: Optional[Sequence[str]]) -> List[str]:
+        """
+        Variables of an artifact in the order of the bands (None is all the variables), which is the order
+        getData asks for them in (see parse_variables). Raises a ValueError for unknown variables.
+        """
+        if variables is None:
+            return list(BANDS)
+        cls._band_numbers(variables)
+        return [name for name in BANDS if name in variables]
+
+    @classmethod
+    def _artifact_variables(cls, variables: Optional[Sequence[str]]) -> str:
+        """Key of the variables of an artifact (None is all the variables)"""
+        return ",".join(cls._artifact_bands(variables))
+
+    @classmethod
+    def _artifact_values(cls, values: Dict[str, Any], artifacts: Sequence[Optional[Sequence[str]]]) -> List[Dict[str, Any]]:
+        """Makes the compressed NetCDF files of the grid with the grid table values for each set of variables in artifacts"""
+        row = tables.Grid(**{key: value for key, value in values.items() if key not in ('raster', 'date')})
+        row.date = datetime.combine(cache.as_date(values['date']), datetime.min.time())
+        row.raster_wkb = bytes(values['raster'])
+        return cls._artifact_rows(row, artifacts)
+
+    @classmethod
+    def _artifact_rows(cls, grid: tables.Grid, artifacts: Sequence[Optional[Sequence[str]]]) -> List[Dict[str, Any]]:
+        """
+        Makes the compressed NetCDF files of a grid (with all its bands in raster_wkb) for each set of variables in artifacts.
+        The grid is decoded from its WKB like getData does, so the files are the same as the ones getData makes.
+        """
+        from .. import archive
+        from ..xarray_operations import raster_to_xarray
+        from ..xarray_operations.netcdf import netcdf_entries
+        dataset = raster_to_xarray(grid)
+        rows = []
+        for variables in artifacts:
+            selected = dataset if variables is None else dataset[cls._artifact_bands(variables)]
+            name, data = next(netcdf_entries([selected]))
+            compressed = archive.compress(name, data)
+            rows.append(dict(
+                resolution_id=grid.resolution_id,
+                date=grid.date,
+                variables=cls._artifact_variables(variables),
+                crc=compressed.crc,
+                size=compressed.size,
+                data=compressed.data
+            ))
+        return rows
+
+    def rebuild_artifacts(self) -> int:
+        """
+        Remakes the stored NetCDF files (see add_grids) from their grids, one day per transaction.
+        Files made before the variables of a file were selected by name had the wrong bands and have to be rebuilt once.
+        Files stored with the variables in another order than the bands (which getData never asked for) are
+        replaced by a file with the variables in the order of the bands. Returns the number of files rebuilt.
+        """
+        artifact = tables.GridArtifact
+        with self.session() as session, session.begin():
+            keys = session.execute(
+                select(artifact.resolution_id, artifact.date, artifact.variables).order_by(artifact.resolution_id, artifact.date)
+            ).all()
+        rebuilt = 0
+        for (resolution_id, day), rows in groupby(keys, key=lambda row: (row.resolution_id, row.date)):
+            names = {self._artifact_variables(row.variables.split(',')) for row in rows}
+            artifacts = [None if name == self._artifact_variables(None) else name.split(',') for name in sorted(names)]
+            with self.session() as session, session.begin():
+                statement = self._select_grids().filter(tables.Grid.resolution_id == resolution_id, tables.Grid.date == day)
+                if (grid := session.scalars(statement).first()) is None:
+                    continue
+                session.execute(delete(artifact).where(artifact.resolution_id == resolution_id, artifact.date == day))
+                tables.GridArtifact.upsert(session, self._artifact_rows(grid, artifacts))
+            rebuilt += len(artifacts)
+        logging.info(f"Rebuilt {rebuilt} artifacts")
+        return rebuilt
+
+    def add_grids(
+        self,
+        datasets: Iterable["xr.Dataset"],
+        days: Iterable[date],
+        resolution: int | tables.Resolution,
+        srid: int = 4326,
+        batch_size: int = 8,
+        artifacts: Sequence[Optional[Sequence[str]]] = (),
+        pack: bool = False,
+        tile_size: Optional[int] = None
+    ) -> int:
+        """
+        Adds many grids to the database in one transaction and returns the number of grids added.
+        The datasets are encoded and inserted batch_size at a time using multi-row inserts.
+        Grids which already exist for the resolution and date are replaced.
+        For each set of variables in artifacts (None is all variables) the compressed NetCDF file of
+        the grid is stored as well, which getData copies instead of encoding the grid.
+        The variables of a file are stored in the order of the bands. Unknown variables raise a ValueError.
+        If pack is True the bands are stored as int16 with a scale and offset, which makes the grids 2-4 times smaller.
+        If tile_size is given the grids are also stored as tiles of tile_size x tile_size pixels, which
+        regional getData requests read instead of the whole grids.
+        """
+        from ..xarray_operations import encode
+        resolution_id = resolution if isinstance(resolution, int) else resolution.id
+        artifacts = [None if variables is None else self._artifact_bands(variables) for variables in artifacts]
+        added = 0
+        days_added: List[date] = []
+        with self.session() as session, session.begin():
+            # Check resolution exists
+            resolution_exists = select(tables.Resolution.id).filter_by(id=resolution_id)
+            if session.scalars(resolution_exists).first() is None:
+                logging.warning(f"No resolution matched resolution_id {resolution_id}. Did not add grids to the grid table.")
+                return 0
+            # Insert grids in batches (a day can only be in a batch once)
+            batch: Dict[date, Dict[str, Any]] = {}
+            tiles: Dict[date, List[Dict[str, Any]]] = {}
+            for dataset, day in zip(datasets, days, strict=True):
+                if pack:
+                    dataset = encode.pack_dataset(dataset)
+                batch[day] = self._grid_values(dataset, day, resolution_id, srid)
+                if tile_size is not None:
+                    tiles[day] = self._tile_values(dataset, day, resolution_id, tile_size, srid)
+                if len(batch) == batch_size:
+                    self._upsert_batch(session, list(batch.values()), list(chain.from_iterable(tiles.values())), artifacts)
+                    added += len(batch)
+                    days_added.extend(batch)
+                    batch = {}
+                    tiles = {}
+            self._upsert_batch(session, list(batch.values()), list(chain.from_iterable(tiles.values())), artifacts)
+            added += len(batch)
+            days_added.extend(batch)
+        for day in days_added:
+            cache.GRIDS.invalidate(resolution_id, day)
+        # The available dates are cached by the name of the resolution, which is not known here
+        cache.CATALOGUE.invalidate_kind("dates")
+        exports.invalidate(resolution_id, days_added)
+        logging.info(f"Added {added} grids to the grid table")
+        return added
+
+    @staticmethod
+    def _delete_derived(session: Any, pairs: Sequence[Tuple[int, datetime]]) -> None:
+        """Deletes the artifacts and tiles of the grids with the (resolution_id, date) pairs"""
+        for table in (tables.GridArtifact, tables.GridTile):
+            session.execute(delete(table).where(tuple_(table.resolution_id, table.date).in_(pairs)))
+
+    @classmethod
+    def _upsert_batch(
+        cls,
+        session: Any,
+        grids: Sequence[Dict[str, Any]],
+        tiles: Sequence[Dict[str, Any]],
+        artifacts: Sequence[Optional[Sequence[str]]]
+    ) -> None:
+        """
+        Inserts a batch of grids with their tiles and artifacts.
+        Tiles and artifacts of replaced grids are deleted first, since they would be stale.
+        """
+        if len(grids) == 0:
+            return
+        tables.Grid.upsert(session, grids)
+        cls._delete_derived(
+            session,
+            [(grid['resolution_id'], datetime.combine(cache.as_date(grid['date']), datetime.min.time())) for grid in grids]
+        )
+        tables.GridTile.insert(session, tiles)
+        if len(artifacts) > 0:
+            tables.GridArtifact.upsert(session, [row for grid in grids for row in cls._artifact_values(grid, artifacts)])
+
+    def add_grid(
+        self,
+        dataset: "xr.Dataset",
+        day: date,
+        resolution: int | tables.Resolution,
+        artifacts: Sequence[Optional[Sequence[str]]] = (),
+        pack: bool = False,
+        tile_size: Optional[int] = None
+    ) -> bool:
+        """Adds a grid to the database (and its tiles and artifacts, see add_grids)"""
+        status = self.add_grids([dataset], [day], resolution, artifacts=artifacts, pack=pack, tile_size=tile_size) == 1
         if status:
             logging.info("Added grid to the database")
         else:
@@ -148,6 +426,68 @@ class Database:
             value_seq: Sequence[int] = value
         return value_seq, table
 
+    @staticmethod
+    def _band_numbers(variables: Sequence[str]) -> List[int]:
+        """Converts names of bands to band numbers in the raster (1-based)"""
+        invalid = [name for name in variables if name not in BANDS]
+        if len(invalid) > 0:
+            raise ValueError(f"Invalid variables: {invalid} valid options are {BANDS}")
+        return [BANDS.index(name) + 1 for name in variables]
+
+    @classmethod
+    def _select_grids(
+        cls,
+        binary: bool = True,
+        bbox: Optional[BoundingBox] = None,
+        variables: Optional[Sequence[str]] = None
+    ) -> Select[tables.Grid]:
+        """
+        Select statement for grids.
+        If binary is True the raster is transferred as binary WKB (ST_AsBinary) in Grid.raster_wkb
+        instead of the HEX-encoded raster column.
+        If bbox is given only grids intersecting it are selected and the rasters are clipped to it
+        in the database. If variables is given only those bands are selected (in the given order).
+        Both bbox and variables are always transferred as binary WKB.
+        """
+        if not binary and bbox is None and variables is None:
+            return select(tables.Grid)
+        statement = cls._filter_region(select(tables.Grid), bbox)
+        return statement.options(
+            defer(tables.Grid.raster),
+            with_expression(tables.Grid.raster_wkb, func.ST_AsBinary(cls._region_raster(bbox, variables)))
+        )
+
+    @classmethod
+    def _region_raster(cls, region: Optional[BoundingBox | Polygon], variables: Optional[Sequence[str]]) -> Any:
+        """Raster of a grid with only the bands of variables (in the given order) clipped to the region in the database"""
+        raster = tables.Grid.raster
+        if variables is not None:
+            raster = func.ST_Band(raster, array(cls._band_numbers(variables)))
+        if region is not None:
+            raster = func.ST_Clip(raster, region.geometry(), True)
+        return raster
+
+    @staticmethod
+    def _filter_region(statement: Select, region: Optional[BoundingBox | Polygon]) -> Select:
+        """Filters a grid statement on the grids intersecting the region"""
+        if region is None:
+            return statement
+        # Same expression as the spatial index
+        return statement.filter(func.ST_ConvexHull(tables.Grid.raster).op('&&')(region.geometry()))
+
+    @classmethod
+    def _select_grids_by_dates(
+        cls,
+        resolution_id: int,
+        start_date: date,
+        end_date: date,
+        binary: bool = True,
+        bbox: Optional[BoundingBox] = None,
+        variables: Optional[Sequence[str]] = None
+    ) -> Select[tables.Grid]:
+        """Select statement for the grids of a resolution between two dates (both included) ordered by date"""
+        return cls._filter_dates(cls._select_grids(binary, bbox, variables), resolution_id, start_date, end_date)
+
     def delete_product(self, product: tables.Product) -> bool:
         """ Delete a product"""
         with self.session() as session, session.begin():
@@ -163,6 +503,7 @@ class Database:
             if deleted_row == 0:
                 return False
             logging.info(f"Deleted {deleted_row} rows in the product table")
+        cache.CATALOGUE.bump()
         return True
 
     def delete_resolutions(
@@ -191,6 +532,7 @@ class Database:
             if deleted_row == 0:
                 return False
             logging.info(f"Deleted {deleted_row} rows in the resolution table")
+        cache.CATALOGUE.bump()
         return True
 
     def delete_grid(
@@ -205,9 +547,16 @@ class Database:
 
         with self.session() as session, session.begin():
             # Get grids for the resolutions
-            find_ids = select(tables.Grid.id).filter(table.in_(value_seq))
-            grid_id = session.scalars(find_ids).all()
+            find_ids = select(tables.Grid.id, tables.Grid.resolution_id, tables.Grid.date).filter(table.in_(value_seq))
+            grids = session.execute(find_ids).all()
+            grid_id = [grid.id for grid in grids]
             empty = len(grid_id) == 0
+            # Delete the tiles and artifacts of the grids
+            if resolution_id is not None:
+                for derived in (tables.GridArtifact, tables.GridTile):
+                    session.execute(delete(derived).where(derived.resolution_id.in_(value_seq)))
+            else:
+                self._delete_derived(session, [(grid.resolution_id, grid.date) for grid in grids])
             if empty and resolution_id is not None:
                 return True
             if empty:
@@ -217,6 +566,11 @@ class Database:
             deleted_row = session.query(tables.Grid).filter(tables.Grid.id.in_(grid_id)).delete()
             if deleted_row == 0:
                 return False
+            for grid in grids:
+                cache.GRIDS.invalidate(grid.resolution_id, grid.date)
+            cache.CATALOGUE.invalidate_kind("dates")
+            for changed in {grid.resolution_id for grid in grids}:
+                exports.invalidate(changed, [grid.date for grid in grids if grid.resolution_id == changed])
             logging.info(f"Deleted {deleted_row} rows in the grid table")
         return True
 
@@ -311,8 +665,11 @@ class Database:
         resolution: Optional[tables.Resolution] = None,
         resolution_name: Optional[str] = None,
         resolution_id: Optional[str] = None,
-    ) -> Sequence[tables.Resolution] | None:
-        """ Get all grid for a resolution in the database"""
+        binary: bool = True,
+        bbox: Optional[BoundingBox] = None,
+        variables: Optional[Sequence[str]] = None,
+    ) -> Sequence[tables.Grid] | None:
+        """ Get all grid for a resolution in the database (optionally clipped to bbox and only with the bands in variables)"""
         # Handle all combinations of input
         res_id = None
         name = None
@@ -339,13 +696,8 @@ class Database:
                 return None
             logging.info("Getting grids")
             output = session.scalars(
-                select(tables.Grid)
-                .filter(
-                    tables.Grid.resolution_id==res_id,
-                    tables.Grid.date >= start_date,
-                    tables.Grid.date <= end_date
-                )
-                ).all()
+                self._select_grids_by_dates(int(res_id), start_date, end_date, binary, bbox, variables)
+            ).all()
             if len(output) == 0:
                 logging.warn(f"No grids with resolution id {res_id} exists.")
                 return []
@@ -353,12 +705,361 @@ class Database:
             return output
         return None
 
+    def iter_grids_by_resolution_and_dates(
+        self,
+        start_date: date,
+        end_date: date,
+        resolution_id: int,
+        bbox: Optional[BoundingBox] = None,
+        variables: Optional[Sequence[str]] = None,
+        dates: Optional[Sequence[date]] = None,
+    ) -> Iterator[tables.Grid]:
+        """
+        Iterates over the grids of a resolution ordered by date.
+        If dates is given only the grids on those dates are fetched (see get_grid_dates).
+        The grids are streamed from the database one at a time, so only one raster is in memory.
+        """
+        if dates is not None and len(dates) == 0:
+            return
+        with self.session(expire_on_commit=False) as session, session.begin():
+            logging.info(f"Streaming grids with resolution_id = {resolution_id}")
+            statement = (
+                self._select_grids_by_dates(resolution_id, start_date, end_date, True, bbox, variables)
+                .execution_options(yield_per=1)
+            )
+            if dates is not None:
+                statement = statement.filter(tables.Grid.date.in_(dates))
+            # Time spent fetching the rows (including the queries) is measured as the fetch stage
+            grids = timing.timed_iter("fetch", session.scalars(statement), lambda grid: len(grid.raster_wkb or b""))
+            for grid in grids:
+                yield grid
+                session.expunge(grid)
+
+    @staticmethod
+    def _filter_dates(statement: Select, resolution_id: int, start_date: Optional[date], end_date: Optional[date]) -> Select:
+        """Filters a grid statement on the resolution and the dates (both included) and orders it by date"""
+        statement = statement.filter(tables.Grid.resolution_id == resolution_id)
+        if start_date is not None:
+            statement = statement.filter(tables.Grid.date >= start_date)
+        if end_date is not None:
+            statement = statement.filter(tables.Grid.date <= end_date)
+        return statement.order_by(tables.Grid.date)
+
+    def get_grid_dates(
+        self,
+        resolution_id: int,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None
+    ) -> Sequence[datetime]:
+        """
+        Dates of the grids of a resolution (optionally between two dates) ordered by date.
+        Only the (resolution_id, date) index is read, so no rasters are loaded.
+        """
+        with self.session() as session, session.begin():
+            statement = self._filter_dates(select(tables.Grid.date), resolution_id, start_date, end_date)
+            return session.scalars(statement).all()
+
+    def get_grid_versions(
+        self,
+        resolution_id: int,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None
+    ) -> Sequence[Row[datetime, str]]:
+        """
+        (date, version) of the grids of a resolution ordered by date.
+        The version is the transaction which last wrote the row (xmin), so it changes when a grid is replaced
+        by an upsert (which keeps the id of the row). No rasters are loaded.
+        """
+        with self.session() as session, session.begin():
+            statement = self._filter_dates(
+                select(tables.Grid.date, literal_column("grid.xmin::text").label('version')),
+                resolution_id, start_date, end_date
+            )
+            return session.execute(statement).all()
+
+    def get_grid_sizes(
+        self,
+        resolution_id: int,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None
+    ) -> Sequence[Row[Tuple[datetime, int, int, int, int]]]:
+        """
+        (date, stored bytes, width, height, bands) of the grids of a resolution ordered by date.
+        The stored bytes are the (compressed) size of the raster column. The raster functions only
+        read the header of the rasters, so the pixels are not loaded.
+        """
+        raster = tables.Grid.raster
+        with self.session() as session, session.begin():
+            statement = self._filter_dates(
+                select(
+                    tables.Grid.date,
+                    func.pg_column_size(raster).label('nbytes'),
+                    func.ST_Width(raster).label('width'),
+                    func.ST_Height(raster).label('height'),
+                    func.ST_NumBands(raster).label('bands')
+                ),
+                resolution_id, start_date, end_date
+            )
+            return session.execute(statement).all()
+
+    def get_grid_metadata(
+        self,
+        resolution_id: int,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None
+    ) -> Sequence[Row]:
+        """Metadata of the grids of a resolution ordered by date as tuples (every column except the raster and its layout)"""
+        columns = [column for column in tables.Grid.__table__.columns if column.name not in ('raster', 'layout')]
+        with self.session() as session, session.begin():
+            statement = self._filter_dates(select(*columns), resolution_id, start_date, end_date)
+            return session.execute(statement).all()
+
+    def get_tile_dates(self, resolution_id: int, start_date: date, end_date: date) -> Sequence[datetime]:
+        """Dates of the grids of a resolution which are stored as tiles (see add_grids) ordered by date"""
+        tile = tables.GridTile
+        with self.session() as session, session.begin():
+            statement = (
+                select(tile.date).distinct()
+                .filter(tile.resolution_id == resolution_id, tile.date >= start_date, tile.date <= end_date)
+                .order_by(tile.date)
+            )
+            return session.scalars(statement).all()
+
+    def iter_tiled_grids(
+        self,
+        start_date: date,
+        end_date: date,
+        resolution_id: int,
+        bbox: Optional[BoundingBox] = None,
+        variables: Optional[Sequence[str]] = None
+    ) -> Iterator[Tuple[tables.Grid, List[tables.GridTile]]]:
+        """
+        Iterates over the tiled grids of a resolution ordered by date as (grid, tiles) (see xarray_operations.tiles_to_xarray).
+        Only the tiles intersecting bbox are fetched, which the spatial index of the tiles finds.
+        The grids only have the metadata and the tiles are streamed, so only the tiles of one day are in memory.
+        """
+        tile = tables.GridTile
+        raster = tile.raster
+        if variables is not None:
+            raster = func.ST_Band(raster, array(self._band_numbers(variables)))
+        statement = (
+            select(tile)
+            .filter(tile.resolution_id == resolution_id, tile.date >= start_date, tile.date <= end_date)
+            .options(defer(tile.raster), with_expression(tile.raster_wkb, func.ST_AsBinary(raster)))
+            .order_by(tile.date, tile.tile_row, tile.tile_column)
+            .execution_options(yield_per=64)
+        )
+        if bbox is not None:
+            # Same expression as the spatial index
+            statement = statement.filter(func.ST_ConvexHull(tile.raster).op('&&')(bbox.envelope()))
+        with self.session(expire_on_commit=False) as session, session.begin():
+            logging.info(f"Streaming tiles with resolution_id = {resolution_id}")
+            grids = self._filter_dates(select(tables.Grid).options(defer(tables.Grid.raster)), resolution_id, start_date, end_date)
+            metadata = {grid.date: grid for grid in session.scalars(grids)}
+            tiles = timing.timed_iter("fetch", session.scalars(statement), lambda tile: len(tile.raster_wkb or b""))
+            for day, day_tiles in groupby(tiles, key=lambda tile: tile.date):
+                day_tiles = list(day_tiles)
+                if day in metadata:
+                    yield metadata[day], day_tiles
+                for expunged in day_tiles:
+                    session.expunge(expunged)
+
+    @classmethod
+    def _select_artifacts(
+        cls,
+        statement: Select,
+        resolution_id: int,
+        start_date: date,
+        end_date: date,
+        variables: Optional[Sequence[str]]
+    ) -> Select:
+        """Filters an artifact statement on the resolution, the dates (both included) and the variables ordered by date"""
+        artifact = tables.GridArtifact
+        return (
+            statement
+            .filter(artifact.resolution_id == resolution_id)
+            .filter(artifact.variables == cls._artifact_variables(variables))
+            .filter(artifact.date >= start_date)
+            .filter(artifact.date <= end_date)
+            .order_by(artifact.date)
+        )
+
+    def get_artifact_dates(
+        self,
+        resolution_id: int,
+        start_date: date,
+        end_date: date,
+        variables: Optional[Sequence[str]] = None
+    ) -> Sequence[datetime]:
+        """Dates which have a precomputed NetCDF file with the variables (see add_grids) ordered by date"""
+        with self.session() as session, session.begin():
+            statement = self._select_artifacts(
+                select(tables.GridArtifact.date), resolution_id, start_date, end_date, variables
+            )
+            return session.scalars(statement).all()
+
+    def iter_grid_artifacts(
+        self,
+        start_date: date,
+        end_date: date,
+        resolution_id: int,
+        variables: Optional[Sequence[str]] = None
+    ) -> Iterator["archive.Compressed"]:
+        """
+        Iterates over the precomputed NetCDF files of a resolution ordered by date as compressed archive entries.
+        The files are streamed from the database one at a time.
+        """
+        from .. import archive
+        artifact = tables.GridArtifact
+        with self.session() as session, session.begin():
+            statement = self._select_artifacts(
+                select(artifact.date, artifact.data, artifact.crc, artifact.size),
+                resolution_id, start_date, end_date, variables
+            ).execution_options(yield_per=1)
+            rows = timing.timed_iter("artifacts", session.execute(statement), lambda row: len(row.data))
+            for row in rows:
+                yield archive.Compressed(f"{row.date.date().isoformat()}.nc", row.data, row.crc, row.size)
+
+    @staticmethod
+    def _unpack_value(value: Optional[float], scale: Optional[Tuple[float, float]]) -> Optional[float]:
+        """Unpacks a pixel value of a packed band (see encode.pack_dataset). Nodata (NULL or NaN) is None"""
+        if value is None or value != value:
+            return None
+        if scale is None:
+            return value
+        scale_factor, add_offset = scale
+        return value * scale_factor + add_offset
+
+    def get_time_series(
+        self,
+        resolution_id: int,
+        lat: float,
+        lon: float,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        variables: Optional[Sequence[str]] = None
+    ) -> List[Tuple[datetime, List[Optional[float]]]]:
+        """
+        Values of the bands at a point for each grid of a resolution as (date, values) ordered by date.
+        The pixels are looked up with ST_Value in the database, so only the values are transferred.
+        Days stored as tiles (see add_grids) only read the tile with the point. Nodata is None.
+        """
+        names = BANDS if variables is None else variables
+        bands = self._band_numbers(names)
+        # The first dimension (latitude) is along the x-axis of the rasters (see BoundingBox.envelope)
+        point = func.ST_SetSRID(func.ST_MakePoint(lat, lon), 4326)
+        tile = tables.GridTile
+        tile_dates = self.get_tile_dates(resolution_id, start_date or date.min, end_date or date.max)
+        with self.session() as session, session.begin():
+            grids = self._filter_dates(
+                select(tables.Grid.date, tables.Grid.scales, *(func.ST_Value(tables.Grid.raster, band, point) for band in bands)),
+                resolution_id, start_date, end_date
+            )
+            rows = list(session.execute(grids.filter(tables.Grid.date.not_in(tile_dates))))
+            if tile_dates:
+                # A point on the edge of two tiles is in both, so only the first tile is used
+                tiles = self._filter_dates(
+                    select(tables.Grid.date, tables.Grid.scales, *(func.ST_Value(tile.raster, band, point) for band in bands))
+                    .join(tile, (tile.resolution_id == tables.Grid.resolution_id) & (tile.date == tables.Grid.date))
+                    .filter(func.ST_ConvexHull(tile.raster).op('&&')(point))
+                    .distinct(tables.Grid.date),
+                    resolution_id, start_date, end_date
+                )
+                rows = sorted([*rows, *session.execute(tiles)], key=lambda row: row[0])
+        series = []
+        for day, scales, *values in rows:
+            scales = json.loads(scales) if scales else {}
+            series.append((day, [self._unpack_value(value, scales.get(name)) for name, value in zip(names, values)]))
+        return series
+
+    STATISTICS = ('count', 'mean', 'stddev', 'min', 'max')
+
+    @staticmethod
+    def _unpack_statistics(values: Sequence[Optional[float]], scale: Optional[Tuple[float, float]]) -> Dict[str, Optional[float]]:
+        """Statistics of a band (see STATISTICS) with packed values unpacked. Statistics of no pixels are None"""
+        count, *floats = values
+        if not count:
+            return dict(count=0, mean=None, stddev=None, min=None, max=None)
+        # Missing statistics (None) are NaN like the ones of nodata
+        mean, stddev, minimum, maximum = (math.nan if value is None else float(value) for value in floats)
+        if scale is not None:
+            # The scale factor is positive, so the minimum and maximum stay in place
+            scale_factor, add_offset = scale
+            mean, stddev = mean * scale_factor + add_offset, stddev * scale_factor
+            minimum, maximum = minimum * scale_factor + add_offset, maximum * scale_factor + add_offset
+        statistics = dict(mean=mean, stddev=stddev, min=minimum, max=maximum)
+        # NaN is not valid JSON
+        return dict(count=int(count), **{key: None if value != value else value for key, value in statistics.items()})
+
+    @classmethod
+    def _band_statistics(cls, raster: Any, band: int, weighted: bool) -> Any:
+        """
+        Lateral subquery with the statistics of a band of a raster (see STATISTICS).
+        Weighted statistics weight each pixel by the cosine of its latitude, which is proportional to its area.
+        """
+        if not weighted:
+            return func.ST_SummaryStats(raster, band, True).table_valued('count', 'sum', 'mean', 'stddev', 'min', 'max').lateral()
+        pixels = func.ST_PixelAsCentroids(raster, band, True).table_valued('geom', 'val', 'x', 'y').alias()
+        # The latitude is along the x-axis of the rasters (see BoundingBox.envelope).
+        # The weights are double precision, so the statistics are computed in double precision
+        weight = func.cos(func.radians(func.ST_X(pixels.c.geom)), type_=Double)
+        mean = func.sum(weight * pixels.c.val) / func.sum(weight)
+        variance = func.sum(weight * pixels.c.val * pixels.c.val) / func.sum(weight) - mean * mean
+        return select(
+            func.count(pixels.c.val).label('count'),
+            mean.label('mean'),
+            func.sqrt(func.greatest(variance, 0)).label('stddev'),
+            func.min(pixels.c.val).label('min'),
+            func.max(pixels.c.val).label('max')
+        ).select_from(pixels).lateral()
+
+    def get_statistics(
+        self,
+        resolution_id: int,
+        start_date: date,
+        end_date: date,
+        region: Optional[BoundingBox | Polygon] = None,
+        variables: Optional[Sequence[str]] = None,
+        weighted: bool = False
+    ) -> List[Tuple[datetime, Dict[str, Dict[str, Optional[float]]]]]:
+        """
+        Statistics (see STATISTICS) of the bands in a region for each grid of a resolution as (date, {variable: statistics}) ordered by date.
+        The grids are clipped and summarised in the database (ST_Clip and ST_SummaryStats), so only the statistics are transferred.
+        If weighted is True the pixels are weighted by their area (see _band_statistics). Nodata pixels are not counted.
+        """
+        names = BANDS if variables is None else variables
+        clipped = self._region_raster(region, variables).label('clipped')
+        grids = self._filter_dates(
+            self._filter_region(select(tables.Grid.date, tables.Grid.scales, clipped), region),
+            resolution_id, start_date, end_date
+        ).subquery()
+        # One lateral subquery per band joined to the clipped grids
+        source: Any = grids
+        columns = []
+        for band in range(1, len(names) + 1):
+            statistics = self._band_statistics(grids.c.clipped, band, weighted)
+            source = source.join(statistics, true())
+            columns.extend(statistics.c[name] for name in self.STATISTICS)
+        statement = select(grids.c.date, grids.c.scales, *columns).select_from(source).order_by(grids.c.date)
+        with self.session() as session, session.begin():
+            rows = session.execute(statement).all()
+        result = []
+        for day, scales, *values in rows:
+            scales = json.loads(scales) if scales else {}
+            count = len(self.STATISTICS)
+            result.append((day, {
+                name: self._unpack_statistics(values[index * count:(index + 1) * count], scales.get(name))
+                for index, name in enumerate(names)
+            }))
+        return result
+
     def get_grids_by_resolution(
         self,
         resolution: Optional[tables.Resolution] = None,
         resolution_name: Optional[str] = None,
         resolution_id: Optional[str] = None,
-    ) -> Sequence[tables.Resolution] | None:
+        binary: bool = True,
+    ) -> Sequence[tables.Grid] | None:
         """ Get all grid for a resolution in the database"""
         # Handle all combinations of input
         res_id = None
@@ -384,7 +1085,7 @@ class Database:
             if res_id is None:
                 logging.warn(f"No resolution with the name '{name}' exists.")
                 return None
-            output = session.scalars(select(tables.Grid).filter_by(resolution_id=res_id)).all()
+            output = session.scalars(self._select_grids(binary).filter_by(resolution_id=res_id)).all()
             if len(output) == 0:
                 logging.warn(f"No grids with resolution id {res_id} exists.")
                 return []
@@ -404,4 +1105,28 @@ class Database:
             logging.warning(f"Failed to login with {username}")
             return False
         logging.info(f"{username} successfully logged in")
-        return True
\ No newline at end of file
+        return True
+
+_DATABASE: Optional[Database] = None
+_DATABASE_LOCK = threading.Lock()
+
+def get_database() -> Database:
+    """
+    Process-wide database, created on first use from the ALTIMETRY_* environment variables.
+    All functions in a worker share the database and therefore its engine and connection pool.
+    """
+    global _DATABASE
+    if _DATABASE is None:
+        with _DATABASE_LOCK:
+            if _DATABASE is None:
+                _DATABASE = Database(
+                    username=environ["ALTIMETRY_USERNAME"],
+                    password=environ["ALTIMETRY_PASSWORD"],
+                    host=environ["ALTIMETRY_HOST"],
+                    port=environ["ALTIMETRY_DATABASE_PORT"],
+                    database_name=environ["ALTIMETRY_DATABASE"],
+                    engine=environ["ALTIMETRY_DATABASE_CONNECTION_ENGINE"],
+                    database_type=environ["ALTIMETRY_DATABASE_TYPE"],
+                    pool=PoolSettings.from_environ()
+                )
+    return _DATABASE
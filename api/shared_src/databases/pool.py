@@ -0,0 +1,67 @@
+from sqlalchemy.pool import QueuePool, PoolProxiedConnection
+from typing import Any, Dict
+import logging
+import threading
+import time
+
+logging.getLogger(__name__)
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool which measures how long a checkout waits for a connection and how many connections are in use.
+    Slow checkouts and a saturated pool (all connections including the overflow in use) are logged,
+    which shows if the pool is too small for the concurrency of the worker.
+    """
+    def __init__(self, *args: Any, slow_checkout_ms: float = 100, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.slow_checkout_ms = slow_checkout_ms
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._wait_ms = 0.0
+        self._max_wait_ms = 0.0
+        self._slow_checkouts = 0
+        self._saturated = 0
+        self._peak_checkedout = 0
+
+    def connect(self) -> PoolProxiedConnection:
+        """Checks out a connection and records the wait"""
+        start = time.perf_counter()
+        connection = super().connect()
+        wait_ms = (time.perf_counter() - start) * 1000
+        checkedout = self.checkedout()
+        capacity = self.size() + max(self._max_overflow, 0)
+        saturated = self._max_overflow > -1 and checkedout >= capacity
+        with self._stats_lock:
+            self._checkouts += 1
+            self._wait_ms += wait_ms
+            self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+            self._peak_checkedout = max(self._peak_checkedout, checkedout)
+            self._slow_checkouts += wait_ms > self.slow_checkout_ms
+            self._saturated += saturated
+        if wait_ms > self.slow_checkout_ms:
+            logging.warning(f"Waited {wait_ms:.0f} ms for a database connection ({checkedout}/{capacity} in use)")
+        if saturated:
+            logging.warning(f"Database pool is saturated ({checkedout}/{capacity} in use)")
+        return connection
+
+    def recreate(self) -> "TimedQueuePool":
+        """Creates a new pool with the same settings (used by SQLAlchemy after a disconnect)"""
+        pool = super().recreate()
+        assert isinstance(pool, TimedQueuePool)
+        pool.slow_checkout_ms = self.slow_checkout_ms
+        return pool
+
+    def stats(self) -> Dict[str, float]:
+        """Counters of the pool"""
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "max_overflow": self._max_overflow,
+                "checkedout": self.checkedout(),
+                "peak_checkedout": self._peak_checkedout,
+                "checkouts": self._checkouts,
+                "mean_wait_ms": self._wait_ms / self._checkouts if self._checkouts else 0.0,
+                "max_wait_ms": self._max_wait_ms,
+                "slow_checkouts": self._slow_checkouts,
+                "saturated_checkouts": self._saturated
+            }
@@ -1,12 +1,12 @@
 from datetime import datetime
-from sqlalchemy import ForeignKey, String, Engine, Double, Text, text
+from sqlalchemy import ForeignKey, String, Engine, Double, Text, Index, BigInteger, LargeBinary, SmallInteger, text
+from sqlalchemy.dialects.postgresql import insert
 import sqlalchemy.orm as orm
 import geoalchemy2 as geo
-import bcrypt
-from typing import List, Any, Dict, overload, Sequence
+from typing import List, Any, Dict, overload, Sequence, Optional
 from os import environ
+from ..xarray_operations.dtypes import RASTER_LAYOUT
 
-SALT: bytes = environ["SALT"].encode()
 BaseClass: Any = orm.declarative_base() # type: ignore
 Base: orm.DeclarativeMeta = BaseClass
 class User(BaseClass):
@@ -16,13 +16,16 @@ class User(BaseClass):
     username: orm.Mapped[str] = orm.mapped_column(Text, unique=True)
     password: orm.Mapped[str] = orm.mapped_column(Text)
 
+    # bcrypt is only imported by the functions which handle passwords
     @staticmethod
     def hash_password(password: str) -> str:
         """ Hashes the password"""
-        return bcrypt.hashpw(password.encode(), SALT).decode()
+        import bcrypt
+        return bcrypt.hashpw(password.encode(), environ["SALT"].encode()).decode()
 
     def verify_password(self, username: str, password: str):
         """ Checks the password and username"""
+        import bcrypt
         pwhash = bcrypt.checkpw(password.encode(), self.password.encode())
         return pwhash and self.username == username
 
@@ -51,10 +54,14 @@ class Resolution(BaseClass):
 
 class Grid(BaseClass):
     __tablename__ = "grid"
+    # Grids are looked up by resolution and date range. This also makes a grid unique per resolution and date.
+    __table_args__ = (Index("ix_grid_resolution_id_date", "resolution_id", "date", unique=True),)
 
     # Fields
     id: orm.Mapped[int] = orm.mapped_column(primary_key=True)
     raster = orm.mapped_column(geo.Raster(from_text = None, spatial_index=True))
+    # Binary WKB of the raster, only loaded when requested with orm.with_expression
+    raster_wkb: orm.Mapped[Optional[bytes]] = orm.query_expression()
     date: orm.Mapped[datetime]
     references: orm.Mapped[str] = orm.mapped_column(String(50))
     ellipsoid: orm.Mapped[str] = orm.mapped_column(String(20))
@@ -65,36 +72,175 @@ class Grid(BaseClass):
     rads: orm.Mapped[str] = orm.mapped_column(String(30))
     total_points: orm.Mapped[int]
     n_points: orm.Mapped[str] = orm.mapped_column(String(40))
+    # JSON with the (scale_factor, add_offset) of each packed band or None if the bands are not packed
+    scales: orm.Mapped[Optional[str]] = orm.mapped_column(Text, nullable=True)
+    # Order of the pixels in the raster (see dtypes.RASTER_LAYOUT)
+    layout: orm.Mapped[int] = orm.mapped_column(SmallInteger, server_default=str(RASTER_LAYOUT))
 
     # Grid
     resolution_id: orm.Mapped[int] = orm.mapped_column(ForeignKey("resolution.id"))
     resolution: orm.Mapped["Resolution"] = orm.relationship(back_populates="grid")
 
-    def insert(self, session: orm.Session):
+    # Columns written by upsert. The raster is passed as binary WKB.
+    UPSERT_COLUMNS = (
+        'date', 'raster', 'references', 'ellipsoid', 'ellipsoid_axis',
+        'ellipsoid_flattening', 'mission_names', 'mission_phase', 'rads',
+        'resolution_id', 'total_points', 'n_points', 'scales', 'layout'
+    )
+
+    @classmethod
+    def upsert(cls, session: orm.Session, grids: Sequence[Dict[str, Any]]) -> None:
+        """
+        Inserts many grids with a single multi-row insert.
+        Grids which already exist for the resolution and date are replaced.
+        """
+        if len(grids) == 0:
+            return
+        casts = {'date': '(:{})::date', 'raster': 'ST_RastFromWKB(:{})'}
+        rows = ', '.join(
+            '(' + ', '.join(casts.get(column, ':{}').format(f'{column}_{i}') for column in cls.UPSERT_COLUMNS) + ')'
+            for i in range(len(grids))
+        )
+        columns = ', '.join(f'"{column}"' for column in cls.UPSERT_COLUMNS)
+        updates = ', '.join(
+            f'"{column}" = EXCLUDED."{column}"' for column in cls.UPSERT_COLUMNS if column not in ('resolution_id', 'date')
+        )
         statement = text(
-            'INSERT INTO "grid" (date, raster, "references",'
-            ' ellipsoid, ellipsoid_axis, ellipsoid_flattening, mission_names,'
-            ' mission_phase, rads, resolution_id, total_points, n_points) VALUES'
-            ' ((:date)::date, (:raster)::raster, :references, :ellipsoid,'
-            ' :ellipsoid_axis, :ellipsoid_flattening, :mission_names,'
-            ' :mission_phase, :rads, :resolution_id, :total_points, :n_points)'
+            f'INSERT INTO "grid" ({columns}) VALUES {rows}'
+            f' ON CONFLICT (resolution_id, date) DO UPDATE SET {updates}'
         )
         session.execute(
             statement, # type: ignore
-            {
-                'date': self.date, 'raster': self.raster,
-                'references': self.references, 'ellipsoid': self.ellipsoid,
-                'ellipsoid_axis': self.ellipsoid_axis, 'ellipsoid_flattening': self.ellipsoid_flattening,
-                'mission_names': self.mission_names, 'mission_phase': self.mission_phase,
-                'rads': self.rads, 'resolution_id': self.resolution_id,
-                'total_points': self.total_points, 'n_points': self.n_points
-            }
+            {f'{column}_{i}': grid[column] for i, grid in enumerate(grids) for column in cls.UPSERT_COLUMNS}
+        )
+
+class GridArtifact(BaseClass):
+    """
+    NetCDF file of a grid (with some or all of its variables) compressed with raw deflate.
+    Artifacts are made when the grids are added, so getData can copy them into the archive.
+    """
+    __tablename__ = "grid_artifact"
+    __table_args__ = (Index("ix_grid_artifact_resolution_id_date_variables", "resolution_id", "date", "variables", unique=True),)
+
+    # Fields
+    id: orm.Mapped[int] = orm.mapped_column(primary_key=True)
+    date: orm.Mapped[datetime]
+    # Comma separated names of the variables in the file
+    variables: orm.Mapped[str] = orm.mapped_column(String(80))
+    crc: orm.Mapped[int] = orm.mapped_column(BigInteger)
+    size: orm.Mapped[int] = orm.mapped_column(BigInteger)
+    data: orm.Mapped[bytes] = orm.mapped_column(LargeBinary)
+
+    # Resolution
+    resolution_id: orm.Mapped[int] = orm.mapped_column(ForeignKey("resolution.id"))
+
+    @classmethod
+    def upsert(cls, session: orm.Session, artifacts: Sequence[Dict[str, Any]]) -> None:
+        """Inserts many artifacts. Artifacts which already exist for the resolution, date and variables are replaced"""
+        if len(artifacts) == 0:
+            return
+        statement = insert(cls).values(list(artifacts))
+        session.execute(statement.on_conflict_do_update(
+            index_elements=['resolution_id', 'date', 'variables'],
+            set_={column: statement.excluded[column] for column in ('crc', 'size', 'data')}
+        ))
+
+class GridTile(BaseClass):
+    """
+    Tile of a grid (see encode.tile_dataset). The tiles of a day cover the grid without overlapping and
+    the spatial index finds the tiles intersecting a region, so regional reads do not read the whole grid.
+    The metadata (and scales) of the tiles are the ones of the grid with the same resolution and date.
+    """
+    __tablename__ = "grid_tile"
+    __table_args__ = (
+        Index("ix_grid_tile_resolution_id_date_tile", "resolution_id", "date", "tile_row", "tile_column", unique=True),
+    )
+
+    # Fields
+    id: orm.Mapped[int] = orm.mapped_column(primary_key=True)
+    raster = orm.mapped_column(geo.Raster(from_text = None, spatial_index=True))
+    # Binary WKB of the raster, only loaded when requested with orm.with_expression
+    raster_wkb: orm.Mapped[Optional[bytes]] = orm.query_expression()
+    date: orm.Mapped[datetime]
+    # Index of the tile along the first (latitude) and second (longitude) dimension of the grid
+    tile_row: orm.Mapped[int]
+    tile_column: orm.Mapped[int]
+    # Order of the pixels in the raster (see dtypes.RASTER_LAYOUT)
+    layout: orm.Mapped[int] = orm.mapped_column(SmallInteger, server_default=str(RASTER_LAYOUT))
+
+    # Resolution
+    resolution_id: orm.Mapped[int] = orm.mapped_column(ForeignKey("resolution.id"))
+
+    INSERT_COLUMNS = ('date', 'tile_row', 'tile_column', 'raster', 'resolution_id', 'layout')
+
+    @classmethod
+    def insert(cls, session: orm.Session, tiles: Sequence[Dict[str, Any]]) -> None:
+        """Inserts many tiles with a single multi-row insert (the raster is passed as binary WKB)"""
+        if len(tiles) == 0:
+            return
+        casts = {'date': '(:{})::date', 'raster': 'ST_RastFromWKB(:{})'}
+        rows = ', '.join(
+            '(' + ', '.join(casts.get(column, ':{}').format(f'{column}_{i}') for column in cls.INSERT_COLUMNS) + ')'
+            for i in range(len(tiles))
+        )
+        columns = ', '.join(f'"{column}"' for column in cls.INSERT_COLUMNS)
+        session.execute(
+            text(f'INSERT INTO "grid_tile" ({columns}) VALUES {rows}'), # type: ignore
+            {f'{column}_{i}': tile[column] for i, tile in enumerate(tiles) for column in cls.INSERT_COLUMNS}
         )
 
 def create_all_tables(engine: Engine) -> None:
     """ Creates all tables if they dont exists"""
     Base.metadata.create_all(engine)
 
+def migrate_grid_index(engine: Engine) -> None:
+    """
+    Creates the unique (resolution_id, date) index on an existing grid table.
+    Duplicated grids for a resolution and date are removed first (the newest grid is kept).
+    """
+    with engine.begin() as connection:
+        connection.execute(text(
+            'DELETE FROM "grid" a USING "grid" b'
+            ' WHERE a.resolution_id = b.resolution_id AND a.date = b.date AND a.id < b.id'
+        ))
+        connection.execute(text(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_grid_resolution_id_date ON "grid" (resolution_id, date)'
+        ))
+        connection.execute(text('ANALYZE "grid"'))
+
+def migrate_grid_scales(engine: Engine) -> None:
+    """Adds the scales column (of packed grids) to an existing grid table"""
+    with engine.begin() as connection:
+        connection.execute(text('ALTER TABLE "grid" ADD COLUMN IF NOT EXISTS scales TEXT'))
+
+def migrate_raster_layout(engine: Engine, batch_size: int = 16) -> int:
+    """
+    Adds the layout column to existing grid and grid_tile tables and rewrites the rasters stored with
+    the pixels in the (lat, lon) order of the arrays in the order of PostGIS (see dtypes.RASTER_LAYOUT).
+    batch_size rasters are rewritten per transaction. Returns the number of rewritten rasters.
+    """
+    from ..xarray_operations import encode
+    rewritten = 0
+    for table in ('grid', 'grid_tile'):
+        with engine.begin() as connection:
+            # Rows which existed before the column are in the old layout
+            connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS layout SMALLINT NOT NULL DEFAULT 0'))
+            connection.execute(text(f'ALTER TABLE "{table}" ALTER COLUMN layout SET DEFAULT {RASTER_LAYOUT}'))
+        while True:
+            with engine.begin() as connection:
+                rows = connection.execute(
+                    text(f'SELECT id, ST_AsBinary(raster) FROM "{table}" WHERE layout < :layout ORDER BY id LIMIT :limit'),
+                    {'layout': RASTER_LAYOUT, 'limit': batch_size}
+                ).all()
+                if len(rows) == 0:
+                    break
+                connection.execute(
+                    text(f'UPDATE "{table}" SET raster = ST_RastFromWKB(:raster), layout = :layout WHERE id = :id'),
+                    [{'id': id, 'raster': bytes(encode.relayout_wkb(wkb)), 'layout': RASTER_LAYOUT} for id, wkb in rows]
+                )
+                rewritten += len(rows)
+    return rewritten
+
 def delete_all_tables(engine: Engine) -> None:
     """ Deletes all the tables"""
     Base.metadata.drop_all(engine)
@@ -0,0 +1,272 @@
+"""
+Export jobs for date ranges which are too large for a getData request.
+A job is queued by getData (mode=export), built by a worker and downloaded through GetExport.
+The queue and the archives are stored in a directory (ALTIMETRY_EXPORT_DIR) which stands in for an
+Azure storage queue and blob container. The worker has to share the directory with the functions.
+Run the worker from the api folder: python -m shared_src.exports
+"""
+from datetime import date, datetime, timezone
+from os import environ
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+JOB_ID = re.compile(r"^[0-9a-f]{40}$")
+# A running job is updated after every grid and a claimed job is started right away.
+# Without updates (or a start) for this long the worker is assumed to have stopped
+STALE_SECONDS = 15 * 60
+
+class ExportRequest(NamedTuple):
+    """Parameters of an export (the same as for getData with the daily format)"""
+    resolution_id: int
+    resolution_name: str
+    start_date: date
+    end_date: date
+    variables: Optional[List[str]] = None
+    bbox: Optional[List[float]] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """JSON compatible parameters"""
+        return {**self._asdict(), "start_date": self.start_date.isoformat(), "end_date": self.end_date.isoformat()}
+
+    @classmethod
+    def from_dict(cls, values: Dict[str, Any]) -> "ExportRequest":
+        """Parameters from as_dict"""
+        return cls(**{
+            **values,
+            "start_date": date.fromisoformat(values["start_date"]),
+            "end_date": date.fromisoformat(values["end_date"])
+        })
+
+    def job_id(self) -> str:
+        """Identical requests have the same job id, which deduplicates the jobs"""
+        return hashlib.sha1(json.dumps(self.as_dict(), sort_keys=True).encode()).hexdigest()
+
+def now() -> str:
+    """Current time for the job status"""
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+class ExportStore:
+    """
+    Queue, status and archives of the export jobs in a directory.
+    queue/<job_id>.json are the queued jobs, jobs/<job_id>.json the status of the jobs and
+    archives/<job_id>.zip the finished archives. Files are replaced atomically, so the functions
+    and the workers can use the directory at the same time.
+    """
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.queue = root / "queue"
+        self.jobs = root / "jobs"
+        self.archives = root / "archives"
+        for folder in (self.queue, self.jobs, self.archives):
+            folder.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _write(path: Path, values: Dict[str, Any]) -> None:
+        """Writes json to a temporary file and moves it in place"""
+        temporary = path.with_suffix(f".{os.getpid()}.tmp")
+        temporary.write_text(json.dumps(values))
+        os.replace(temporary, path)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status of a job or None if the job does not exist"""
+        if not JOB_ID.match(job_id):
+            return None
+        try:
+            return json.loads((self.jobs / f"{job_id}.json").read_text())
+        except FileNotFoundError:
+            return None
+
+    def update(self, job_id: str, **values: Any) -> Dict[str, Any]:
+        """Updates the status of a job"""
+        status = {**(self.status(job_id) or {}), **values, "job_id": job_id, "updated": now()}
+        self._write(self.jobs / f"{job_id}.json", status)
+        return status
+
+    def _stale(self, job_id: str, status: Dict[str, Any]) -> bool:
+        """
+        If a running job has not been updated for STALE_SECONDS or a queued job was claimed STALE_SECONDS ago
+        without being started (the worker stopped between claim and run_job)
+        """
+        if status["state"] == RUNNING:
+            path = self.jobs / f"{job_id}.json"
+        elif status["state"] == QUEUED:
+            path = self.queue / f"{job_id}.claimed"
+        else:
+            return False
+        try:
+            return time.time() - path.stat().st_mtime > STALE_SECONDS
+        except FileNotFoundError:
+            return False
+
+    def archive(self, job_id: str) -> Path:
+        """Path of the archive of a job"""
+        return self.archives / f"{job_id}.zip"
+
+    def read_archive(self, job_id: str, start: int, length: int) -> bytes:
+        """Reads length bytes from start of the archive of a job, so a download does not load the whole archive"""
+        with self.archive(job_id).open("rb") as file:
+            file.seek(start)
+            return file.read(length)
+
+    def submit(self, request: ExportRequest) -> Dict[str, Any]:
+        """
+        Queues a job and returns its status. An identical job which is queued, running or done is reused
+        unless the grids of the job changed since it was queued (see invalidate).
+        """
+        job_id = request.job_id()
+        status = self.status(job_id)
+        if status is not None and status["state"] != FAILED and not status.get("outdated") and not self._stale(job_id, status):
+            logging.info(f"Reusing export job {job_id} ({status['state']})")
+            return status
+        status = self.update(
+            job_id, state=QUEUED, request=request.as_dict(),
+            done=0, total=None, bytes=0, error=None, outdated=False, created=now()
+        )
+        # The claim of a stopped worker is removed, so the job is only in the queue once
+        self.complete(job_id)
+        self._write(self.queue / f"{job_id}.json", request.as_dict())
+        logging.info(f"Queued export job {job_id}")
+        return status
+
+    def claim(self) -> Optional[str]:
+        """Takes the oldest job from the queue. Only one worker can claim a job"""
+        for message in sorted(self.queue.glob("*.json"), key=lambda path: path.stat().st_mtime):
+            claimed = message.with_suffix(".claimed")
+            try:
+                message.rename(claimed)
+            except FileNotFoundError:
+                # Claimed by another worker
+                continue
+            # The time of the claim tells if the worker stopped before it started the job (see _stale)
+            os.utime(claimed)
+            return message.stem
+        return None
+
+    def complete(self, job_id: str) -> None:
+        """Removes a claimed job from the queue"""
+        (self.queue / f"{job_id}.claimed").unlink(missing_ok=True)
+
+    def invalidate(self, resolution_id: int, days: Optional[Iterable[date | datetime]] = None) -> int:
+        """
+        Marks the jobs of a resolution which include any of the days (all jobs of the resolution if days is None)
+        as outdated, since their grids were added, replaced or deleted. Outdated jobs are queued again by submit.
+        Returns the number of jobs marked.
+        """
+        changed = None if days is None else {day.date() if isinstance(day, datetime) else day for day in days}
+        marked = 0
+        for path in self.jobs.glob("*.json"):
+            status = self.status(path.stem)
+            if status is None or status.get("outdated") or status.get("request", {}).get("resolution_id") != resolution_id:
+                continue
+            request = ExportRequest.from_dict(status["request"])
+            if changed is not None and not any(request.start_date <= day <= request.end_date for day in changed):
+                continue
+            self.update(path.stem, outdated=True)
+            marked += 1
+        if marked > 0:
+            logging.info(f"Marked {marked} export jobs of resolution {resolution_id} as outdated")
+        return marked
+
+    def delete_expired(self, max_age: float) -> None:
+        """Deletes finished or failed jobs (and their archives) which are older than max_age seconds"""
+        for path in self.jobs.glob("*.json"):
+            if time.time() - path.stat().st_mtime < max_age:
+                continue
+            status = json.loads(path.read_text())
+            if status["state"] in (DONE, FAILED):
+                self.archive(path.stem).unlink(missing_ok=True)
+                path.unlink(missing_ok=True)
+
+def get_store() -> ExportStore:
+    """Store in ALTIMETRY_EXPORT_DIR (default is a folder in the temporary directory)"""
+    return ExportStore(Path(environ.get("ALTIMETRY_EXPORT_DIR", Path(tempfile.gettempdir()) / "altimetry_exports")))
+
+def invalidate(resolution_id: int, days: Optional[Iterable[date | datetime]] = None) -> None:
+    """Marks the export jobs of changed grids as outdated (see ExportStore.invalidate)"""
+    get_store().invalidate(resolution_id, days)
+
+def run_job(db: Any, store: ExportStore, job_id: str) -> None:
+    """
+    Builds the archive of a job. Grids are encoded in parallel and streamed into the archive file in date order,
+    so the memory used does not depend on the number of days.
+    """
+    # Imported here, so the functions which only queue jobs do not import xarray
+    from . import archive
+    from .databases import BoundingBox
+    from .xarray_operations import raster_to_xarray
+    from .xarray_operations.netcdf import compressed_netcdf_entries
+
+    if (job := store.status(job_id)) is None:
+        # The status expired (see delete_expired) while the job was in the queue
+        logging.warning(f"Export job {job_id} has no status and is skipped")
+        return
+    path = store.archive(job_id)
+    partial = path.with_suffix(".part")
+    try:
+        request = ExportRequest.from_dict(job["request"])
+        total = len(db.get_grid_dates(request.resolution_id, request.start_date, request.end_date))
+        status = store.update(job_id, state=RUNNING, total=total, started=now())
+        rasters = db.iter_grids_by_resolution_and_dates(
+            start_date=request.start_date,
+            end_date=request.end_date,
+            resolution_id=request.resolution_id,
+            bbox=None if request.bbox is None else BoundingBox(*request.bbox),
+            variables=request.variables
+        )
+        entries = compressed_netcdf_entries(raster_to_xarray(raster, request.variables) for raster in rasters)
+        written = 0
+        with partial.open("wb") as file:
+            stream = archive.ZipStream()
+            for done, entry in enumerate(entries, start=1):
+                for chunk in stream.add_compressed(*entry):
+                    written += file.write(chunk)
+                status = store.update(job_id, done=done, bytes=written)
+            for chunk in stream.close():
+                written += file.write(chunk)
+        os.replace(partial, path)
+        store.update(job_id, state=DONE, bytes=written, finished=now())
+        logging.info(f"Export job {job_id} finished with {status['done']} grids ({written} bytes)")
+    except Exception as error:
+        partial.unlink(missing_ok=True)
+        store.update(job_id, state=FAILED, error=str(error), finished=now())
+        logging.exception(f"Export job {job_id} failed")
+
+def work(db: Any, store: ExportStore, poll_interval: float, max_age: float, once: bool = False) -> None:
+    """Runs the queued jobs one at a time. Polls the queue when it is empty unless once is True"""
+    while True:
+        store.delete_expired(max_age)
+        while (job_id := store.claim()) is not None:
+            try:
+                run_job(db, store, job_id)
+            finally:
+                store.complete(job_id)
+        if once:
+            return
+        time.sleep(poll_interval)
+
+def main() -> None:
+    import argparse
+    from .databases import get_database
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--poll-interval', type=float, default=5, help="Seconds between checks of an empty queue")
+    parser.add_argument('--max-age', type=float, default=float(environ.get("ALTIMETRY_EXPORT_MAX_AGE_HOURS", 24)), help="Hours finished jobs are kept")
+    parser.add_argument('--once', action='store_true', help="Stop when the queue is empty")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    work(get_database(), get_store(), args.poll_interval, args.max_age * 3600, args.once)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import environ
+from typing import Callable, Deque, Iterable, Iterator, Optional, TypeVar
+import contextvars
+import logging
+import os
+
+logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+def workers_from_environ() -> int:
+    """Number of threads used for the per-day work of a request (ALTIMETRY_ENCODE_WORKERS, default is the number of cores up to 4)"""
+    default = min(os.cpu_count() or 1, 4)
+    return max(int(environ.get("ALTIMETRY_ENCODE_WORKERS", default)), 1)
+
+def ordered_map(
+    function: Callable[[T], R],
+    items: Iterable[T],
+    workers: Optional[int] = None,
+    prefetch: int = 2
+) -> Iterator[R]:
+    """
+    Applies function to the items in a bounded thread pool and yields the results in the order of the items.
+    At most workers * prefetch items are in flight, so the memory used does not depend on the number of items.
+    The items are taken from the iterable in the calling thread, so e.g. a database stream is only used by one thread.
+    NetCDF encoding and deflate release the GIL for most of their time, which is why threads are enough.
+    Each item runs in a copy of the context of the caller, so timing stages are added to the current request.
+    """
+    workers = workers_from_environ() if workers is None else workers
+    if workers <= 1:
+        yield from map(function, items)
+        return
+    pending: Deque[Future[R]] = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encode") as executor:
+        try:
+            for item in items:
+                pending.append(executor.submit(contextvars.copy_context().run, function, item))
+                if len(pending) >= workers * prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Work which is not needed anymore (e.g. after an error) is not started
+            for future in pending:
+                future.cancel()
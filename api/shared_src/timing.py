@@ -0,0 +1,135 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TypeVar
+import json
+import logging
+import threading
+import time
+
+logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+class Stage:
+    """Accumulated time, bytes and number of calls of a stage"""
+    __slots__ = ('seconds', 'nbytes', 'count')
+
+    def __init__(self) -> None:
+        self.seconds = 0.0
+        self.nbytes = 0
+        self.count = 0
+
+class Measurement:
+    """Bytes handled by a measured stage, which can be set after the stage has run"""
+    __slots__ = ('nbytes',)
+
+    def __init__(self, nbytes: int = 0) -> None:
+        self.nbytes = nbytes
+
+class Timings:
+    """
+    Time spent in each stage of a request.
+    Stages are accumulated, so a stage which runs once per grid is reported as the sum over the grids
+    (and over the threads, so stages run in parallel can add up to more than the total).
+    Only time.perf_counter is called per measurement, which is cheap enough to always be enabled.
+    """
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.stages: Dict[str, Stage] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float, nbytes: int = 0) -> None:
+        """Adds a measurement to a stage"""
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = Stage()
+            stage.seconds += seconds
+            stage.nbytes += nbytes
+            stage.count += 1
+
+    def total(self) -> float:
+        """Seconds since the request started"""
+        return time.perf_counter() - self.start
+
+    def header(self) -> str:
+        """Value of the Server-Timing header (durations in milliseconds)"""
+        metrics = [f"{name};dur={stage.seconds * 1000:.1f}" for name, stage in self.stages.items()]
+        metrics.append(f"total;dur={self.total() * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Stages with the time in milliseconds, bytes and number of calls"""
+        return {
+            "total_ms": round(self.total() * 1000, 1),
+            "stages": {
+                name: {"ms": round(stage.seconds * 1000, 1), "bytes": stage.nbytes, "count": stage.count}
+                for name, stage in self.stages.items()
+            }
+        }
+
+    def log(self, name: str) -> None:
+        """Logs the timings as one JSON line"""
+        logging.info(f"Timings {json.dumps({'function': name, **self.as_dict()})}")
+
+_CURRENT: ContextVar[Optional[Timings]] = ContextVar("timings", default=None)
+
+def current() -> Optional[Timings]:
+    """Timings of the current request or None if the request is not timed"""
+    return _CURRENT.get()
+
+@contextmanager
+def request() -> Iterator[Timings]:
+    """Times the stages measured while the context is active"""
+    timings = Timings()
+    token = _CURRENT.set(timings)
+    try:
+        yield timings
+    finally:
+        _CURRENT.reset(token)
+
+@contextmanager
+def measure(name: str, nbytes: int = 0) -> Iterator[Measurement]:
+    """
+    Adds the time spent in the context to a stage of the current request.
+    The bytes can also be set on the yielded measurement when they are only known after the stage.
+    """
+    measurement = Measurement(nbytes)
+    timings = _CURRENT.get()
+    if timings is None:
+        yield measurement
+        return
+    start = time.perf_counter()
+    try:
+        yield measurement
+    finally:
+        timings.add(name, time.perf_counter() - start, measurement.nbytes)
+
+def timed_iter(name: str, iterable: Iterable[T], nbytes: Optional[Callable[[T], int]] = None) -> Iterator[T]:
+    """Adds the time spent producing each item of an iterable (e.g. fetching rows) to a stage"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        if (timings := _CURRENT.get()) is not None:
+            timings.add(name, time.perf_counter() - start, 0 if nbytes is None else nbytes(item))
+        yield item
+
+def instrument_engine(engine: Any, name: str = "sql") -> None:
+    """Times every statement executed by a SQLAlchemy engine as a stage"""
+    from sqlalchemy import event
+
+    # The start is stored on the execution context, which belongs to a single statement
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+        if context is not None and _CURRENT.get() is not None:
+            context.timing_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+        start = getattr(context, "timing_start", None)
+        if start is not None and (timings := _CURRENT.get()) is not None:
+            timings.add(name, time.perf_counter() - start)
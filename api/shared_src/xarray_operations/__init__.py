@@ -1,2 +1,20 @@
-from . import dtypes, encode, sizes
-from .decode import read_wkb_raster, raster_to_xarray
\ No newline at end of file
+from importlib import import_module
+from typing import Any, TYPE_CHECKING
+from . import dtypes
+from .dtypes import BANDS
+
+# numpy and xarray are only imported when the encoder/decoder is used
+if TYPE_CHECKING:
+    from . import encode, sizes, decode, netcdf
+    from .decode import read_wkb_raster, raster_to_xarray, rasters_to_stacked_xarray, tiles_to_xarray
+
+_SUBMODULES = ['encode', 'sizes', 'decode', 'netcdf']
+_DECODE = ['read_wkb_raster', 'raster_to_xarray', 'rasters_to_stacked_xarray', 'tiles_to_xarray']
+
+def __getattr__(name: str) -> Any:
+    """Imports the submodules on first access"""
+    if name in _SUBMODULES:
+        return import_module(f"{__name__}.{name}")
+    if name in _DECODE:
+        return getattr(import_module(f"{__name__}.decode"), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,48 +1,249 @@
-from struct import unpack
+from struct import unpack_from
+from typing import Any, Dict, Iterable, List, Literal, Tuple, Optional, Sequence
+import json
 import numpy as np
 import xarray as xr
 from datetime import timedelta
+from .dtypes import BANDS
+from .. import timing
 
 
 __all__ = [
+    'BANDS',
     'read_wkb_raster',
-    'raster_to_xarray'
+    'raster_to_xarray',
+    'tiles_to_xarray',
+    'rasters_to_stacked_xarray',
+    'raster_coordinates',
+    'dataset_order',
+    'raster_scales',
+    'unpack_band'
 ]
 
-def raster_to_xarray(raster):
-    decoded_data = read_wkb_raster(raster.raster.data)
-    data_vars = ['sla', 'sst', 'swh', 'wind_speed']
-    lats = np.arange(-80+decoded_data['scaleY']/2,80+decoded_data['scaleY']/2,decoded_data['scaleY'])
-    lons = np.arange(-180+decoded_data['scaleX']/2,180+decoded_data['scaleX']/2,decoded_data['scaleX'])
+# Grid columns which are not stored as attributes
+NON_ATTRIBUTES = ['raster', 'raster_wkb', 'date', 'id', 'resolution_id', 'scales', 'layout', '_sa_instance_state']
 
+def raster_wkb(raster) -> str | bytes | memoryview:
+    """WKB of a grid. Prefers the binary WKB (ST_AsBinary) and falls back to the hex encoded raster column"""
+    return raster.raster_wkb if raster.raster_wkb is not None else raster.raster.data
+
+def raster_time(raster) -> np.datetime64:
+    """Time of a grid (the middle of the day)"""
+    return np.datetime64(raster.date + timedelta(hours=12), 'ns')
+
+def raster_attributes(raster) -> Dict[str, Any]:
+    """Metadata of a grid"""
+    return {key: value for key, value in raster.__dict__.items() if key not in NON_ATTRIBUTES}
+
+def raster_scales(raster) -> Dict[str, Tuple[float, float]]:
+    """(scale_factor, add_offset) of the packed bands of a grid (see encode.pack_dataset)"""
+    scales = getattr(raster, 'scales', None)
+    if not scales:
+        return {}
+    return {name: (scale_factor, add_offset) for name, (scale_factor, add_offset) in json.loads(scales).items()}
+
+def unpack_band(band: Dict[str, Any], scale: Tuple[float, float]) -> np.ndarray:
+    """Unpacks the pixels of a packed band to float32 with NaN as nodata"""
+    scale_factor, add_offset = scale
+    pixels = band['ndarray']
+    unpacked = pixels.astype(np.float32) * np.float32(scale_factor) + np.float32(add_offset)
+    if band['hasNodataValue']:
+        unpacked[pixels == band['nodata']] = np.nan
+    return unpacked
+
+def band_variable(band: Dict[str, Any], scale: Optional[Tuple[float, float]], unpack: bool) -> Tuple[List[str], np.ndarray, Dict[str, Any]]:
+    """
+    Variable of a band. Packed bands keep their int16 pixels with the CF packing attributes, which
+    are written to NetCDF unchanged (readers like xarray unpack them). unpack converts them to float32 instead.
+    """
+    if scale is None:
+        return ['lats', 'lons'], band['ndarray'], {}
+    if unpack:
+        return ['lats', 'lons'], unpack_band(band, scale), {}
+    attrs = {'scale_factor': scale[0], 'add_offset': scale[1], '_FillValue': band['ndarray'].dtype.type(band['nodata'])}
+    return ['lats', 'lons'], band['ndarray'], attrs
+
+def raster_to_xarray(raster, variables: Optional[Sequence[str]] = None, unpack: bool = False):
+    """
+    Converts a grid to a dataset. variables are the names of the bands in the raster (default is all bands).
+    Packed bands keep the CF packing attributes unless unpack is True (see band_variable).
+    """
+    wkb = raster_wkb(raster)
+    with timing.measure("read_wkb", len(wkb)):
+        decoded_data = read_wkb_raster(wkb)
+
+    with timing.measure("to_xarray"):
+        lats, lons = raster_coordinates(decoded_data)
+        return bands_to_xarray(raster, decoded_data['bands'], lats, lons, variables, unpack)
+
+def bands_to_xarray(
+    raster,
+    bands: Sequence[Dict[str, Any]],
+    lats: np.ndarray,
+    lons: np.ndarray,
+    variables: Optional[Sequence[str]] = None,
+    unpack: bool = False
+) -> xr.Dataset:
+    """Dataset of decoded bands with the coordinates, time and metadata of the grid"""
+    data_vars = BANDS if variables is None else variables
+    scales = raster_scales(raster)
     return xr.Dataset(
         data_vars={
-            name:(['lats','lons'], band['ndarray']) for name, band in zip(data_vars, decoded_data['bands'])
+            name: band_variable(band, scales.get(name), unpack) for name, band in zip(data_vars, bands)
         },
         coords=dict(
             Longitude=(['lons'], lons),
             Latitude=(['lats'], lats),
-            time=np.datetime64(raster.date + timedelta(hours=12), 'ns')
+            time=raster_time(raster)
         ),
-        attrs={key: value for key, value in raster.__dict__.items() if key not in ['raster', 'date', 'id', 'resolution_id', '_sa_instance_state']}
+        attrs=raster_attributes(raster)
     )
 
-def read_wkb_raster(wkb):
-    """Read a WKB raster to a Numpy array."""
-    wkb = bytes(bytearray.fromhex(wkb))
+def tiles_to_xarray(
+    raster,
+    tiles: Sequence[Any],
+    variables: Optional[Sequence[str]] = None,
+    bounds: Optional[Tuple[float, float, float, float]] = None,
+    unpack: bool = False
+) -> xr.Dataset:
+    """
+    Reassembles tiles of a grid (see encode.tile_dataset) into one dataset.
+    raster is the grid with the metadata and tiles have a tile_row, tile_column and WKB (raster_wkb) each.
+    The tiles have to form a rectangle, which the tiles intersecting a bounding box do.
+    If bounds (min_lat, max_lat, min_lon, max_lon) is given the dataset is cropped to the pixels with their center inside it,
+    which are the pixels ST_Clip keeps of grids which are not tiled. So a day has the same pixels whether it is tiled or not.
+    """
+    if len(tiles) == 0:
+        raise ValueError("tiles can not be empty")
+    with timing.measure("read_wkb", sum(len(raster_wkb(tile)) for tile in tiles)):
+        decoded = {(tile.tile_row, tile.tile_column): read_wkb_raster(raster_wkb(tile)) for tile in tiles}
+    rows = sorted({row for row, _ in decoded})
+    columns = sorted({column for _, column in decoded})
+    if len(decoded) != len(rows) * len(columns):
+        raise ValueError(f"Tiles of grid {raster.date} do not form a rectangle")
+
+    with timing.measure("to_xarray"):
+        # Coordinates of each row (first dimension) and column (second dimension) of tiles
+        lats = np.concatenate([raster_coordinates(decoded[row, columns[0]])[0] for row in rows])
+        lons = np.concatenate([raster_coordinates(decoded[rows[0], column])[1] for column in columns])
+        first = decoded[rows[0], columns[0]]
+        arrays = [np.empty((lats.size, lons.size), dtype=band['ndarray'].dtype) for band in first['bands']]
+        x = 0
+        for row in rows:
+            y = 0
+            for column in columns:
+                tile = decoded[row, column]
+                for array, band in zip(arrays, tile['bands']):
+                    array[x:x + tile['width'], y:y + tile['height']] = band['ndarray']
+                y += tile['height']
+            x += decoded[row, columns[0]]['width']
+
+        if bounds is not None:
+            min_lat, max_lat, min_lon, max_lon = bounds
+            keep_lats = (lats >= min_lat) & (lats <= max_lat)
+            keep_lons = (lons >= min_lon) & (lons <= max_lon)
+            lats, lons = lats[keep_lats], lons[keep_lons]
+            arrays = [array[keep_lats][:, keep_lons] for array in arrays]
+        bands = [{**band, 'ndarray': array} for band, array in zip(first['bands'], arrays)]
+        return bands_to_xarray(raster, bands, lats, lons, variables, unpack)
+
+def rasters_to_stacked_xarray(rasters: Iterable[Any], count: int, variables: Optional[Sequence[str]] = None) -> xr.Dataset:
+    """
+    Converts up to count grids with the same shape to one dataset with a time dimension.
+    The grids are decoded one at a time into one (time, lats, lons) array per band, which is preallocated for count grids
+    with the shape of the first grid. So only the arrays and a single grid are in memory when rasters is a stream.
+    Fewer grids than count give a shorter time dimension. The metadata of the grids are stored as variables along the time dimension.
+    Packed bands are unpacked, since the grids can have different scales.
+    """
+    data_vars = BANDS if variables is None else variables
+    arrays: Optional[List[np.ndarray]] = None
+    shape = (0, 0)
+    lats = lons = np.empty(0)
+    times = np.empty(count, dtype='datetime64[ns]')
+    attributes: Dict[str, list] = {}
+    stacked = 0
+
+    for index, raster in enumerate(rasters):
+        if index == count:
+            raise ValueError(f"More than {count} grids were stacked")
+        decoded_data = read_wkb_raster(raster_wkb(raster))
+        scales = raster_scales(raster)
+        if arrays is None:
+            shape = (decoded_data['width'], decoded_data['height'])
+            lats, lons = raster_coordinates(decoded_data)
+            arrays = [
+                np.empty((count, *shape), dtype=np.float32 if name in scales else band['ndarray'].dtype)
+                for name, band in zip(data_vars, decoded_data['bands'])
+            ]
+        if (decoded_data['width'], decoded_data['height']) != shape:
+            raise ValueError(f"Grid {raster.date} has shape {(decoded_data['width'], decoded_data['height'])} expected {shape}")
+        for name, array, band in zip(data_vars, arrays, decoded_data['bands']):
+            if name not in scales:
+                array[index] = band['ndarray']
+            elif np.issubdtype(array.dtype, np.floating):
+                array[index] = unpack_band(band, scales[name])
+            else:
+                raise ValueError(f"Band {name} of grid {raster.date} is packed, but it is not packed in the first grid")
+        times[index] = raster_time(raster)
+        for key, value in raster_attributes(raster).items():
+            attributes.setdefault(key, []).append(value)
+        stacked = index + 1
+
+    if arrays is None:
+        raise ValueError("rasters can not be empty")
+    if stacked < count:
+        arrays, times = [array[:stacked] for array in arrays], times[:stacked]
+
+    return xr.Dataset(
+        data_vars={
+            **{name: (['time', 'lats', 'lons'], array) for name, array in zip(data_vars, arrays)},
+            **{key: (['time'], values) for key, values in attributes.items()}
+        },
+        coords=dict(
+            Longitude=(['lons'], lons),
+            Latitude=(['lats'], lats),
+            time=(['time'], times)
+        )
+    )
+
+def dataset_order(pixels: np.ndarray) -> np.ndarray:
+    """
+    View of pixels in the row-major (height, width) order of PostGIS as (lat, lon) pixels (inverse of encode.raster_order).
+    The rows are along the longitude starting from the top, so the longitudes are reversed to be increasing.
+    """
+    return pixels.T[:, ::-1]
+
+def raster_coordinates(decoded_data: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Coordinates of the pixel centers from the raster header (inverse of sizes.transform).
+    The first dimension is along the x-axis and the second along the y-axis starting from the bottom (see dataset_order).
+    """
+    width, height = decoded_data['width'], decoded_data['height']
+    lats = decoded_data['ipX'] + decoded_data['scaleX'] * (np.arange(width) + 0.5)
+    lons = decoded_data['ipY'] + decoded_data['scaleY'] * (height - np.arange(height) - 0.5)
+    return lats, lons
+
+def read_wkb_raster(wkb: str | bytes | memoryview) -> Dict[str, Any]:
+    """
+    Read a WKB raster to a Numpy array.
+    `wkb` is either the HEX-encoded WKB of a raster column or the binary WKB from ST_AsBinary.
+    The band arrays are read-only views into the binary buffer (no copies are made) with
+    the shape (width, height) of the (lat, lon) datasets (see dataset_order).
+    """
+    if isinstance(wkb, str):
+        wkb = bytes.fromhex(wkb)
+    wkb = memoryview(wkb).cast('B')
     ret = {}
 
     # Determine the endiannes of the raster
-    (endian,) = unpack('<b', wkb[:1])
-
-    if endian == 0:
-        endian = '>'
-    elif endian == 1:
-        endian = '<'
+    (byte_order,) = unpack_from('<b', wkb, 0)
+    if byte_order not in (0, 1):
+        raise ValueError(f"Invalid endianness {byte_order} of the WKB raster")
+    endian: Literal['>', '<'] = '>' if byte_order == 0 else '<'
 
     # Read the raster header data.
     (version, bands, scaleX, scaleY, ipX, ipY, skewX, skewY,
-     srid, width, height) = unpack(endian + 'HHddddddIHH', wkb[1:61])
+     srid, width, height) = unpack_from(endian + 'HHddddddIHH', wkb, 1)
 
     ret['version'] = version
     ret['scaleX'] = scaleX
@@ -61,7 +262,7 @@ def read_wkb_raster(wkb):
         band = {}
         # Requires reading a single byte, and splitting the bits into the
         # header attributes
-        (bits,) = unpack(endian + 'b', wkb[position:position+1])
+        (bits,) = unpack_from(endian + 'b', wkb, position)
         position += 1
 
         band['isOffline'] = bool(bits & 128)  # first bit
@@ -71,19 +272,19 @@ def read_wkb_raster(wkb):
         pixtype = bits & 15  # bits 5-8
 
         # Based on the pixel type, determine the struct format, byte size and
-        # numpy dtype
+        # numpy dtype (pixel type 9 is not used, 10 is PT_32BF and 11 is PT_64BF)
         fmts = ['?', 'B', 'B', 'b', 'B', 'h',
-                'H', 'i', 'I', 'f', 'd', 'd']
+                'H', 'i', 'I', 'f', 'f', 'd']
         dtypes = ['b1', 'u1', 'u1', 'i1', 'u1', 'i2',
-                  'u2', 'i4', 'u4', 'f4', 'f8', 'f8']
-        sizes = [1, 1, 1, 1, 1, 2, 2, 4, 4, 4, 8, 8]
+                  'u2', 'i4', 'u4', 'f4', 'f4', 'f8']
+        sizes = [1, 1, 1, 1, 1, 2, 2, 4, 4, 4, 4, 8]
 
         dtype = dtypes[pixtype]
         size = sizes[pixtype]
         fmt = fmts[pixtype]
 
         # Read the nodata value
-        (nodata,) = unpack(endian + fmt, wkb[position:position+size])
+        (nodata,) = unpack_from(endian + fmt, wkb, position)
         position += size
 
         band['nodata'] = nodata
@@ -93,31 +294,29 @@ def read_wkb_raster(wkb):
             # Read the out-db metadata
 
             # offline bands are 0-based, make 1-based for user consumption
-            (band_num,) = unpack(endian + 'B', wkb[position:position+1])
+            (band_num,) = unpack_from(endian + 'B', wkb, position)
             position += 1
             band['bandNumber'] = band_num + 1
 
-            data = b''
-            while True:
-                byte = wkb[position:position+1]
-                position += 1
-                if byte == b'\x00':
-                    break
-
-                data += byte
-
-            band['path'] = data.decode()
+            # Null terminated path
+            end = position
+            while wkb[end] != 0:
+                end += 1
+            band['path'] = bytes(wkb[position:end]).decode()
+            position = end + 1
 
         else:
 
-            # Read the pixel values: width * height * size
-            band['ndarray'] = np.ndarray(
-                (width, height),
-                buffer=wkb[position:position+width * height * size],
-                dtype=np.dtype(dtype)
-            )
+            # View the pixel values: width * height * size
+            band['ndarray'] = np.frombuffer(
+                wkb,
+                dtype=np.dtype(dtype).newbyteorder(endian),
+                count=width * height,
+                offset=position
+            ).reshape(height, width)
+            band['ndarray'] = dataset_order(band['ndarray'])
             position += width * height * size
 
         ret['bands'].append(band)
 
-    return ret
\ No newline at end of file
+    return ret
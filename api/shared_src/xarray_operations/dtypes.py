@@ -1,3 +1,18 @@
+# Names of the bands in the order they are stored in the rasters
+BANDS = ['sla', 'sst', 'swh', 'wind_speed']
+
+# Order of the pixels in the rasters (see encode.raster_order). 0 is the (lat, lon) order of the arrays used by
+# older grids and 1 is the order of PostGIS, which grids with an older layout are migrated to (see tables.migrate_raster_layout)
+RASTER_LAYOUT = 1
+
+# Packed bands (see encode.pack_dataset) are stored as int16 with the smallest value as nodata
+PACKED_DTYPE = 'int16'
+PACKED_NODATA = -32768
+PACKED_MAX = 32767
+
+# Floating point pixel types (nodata is NaN unless the band has a _FillValue)
+FLOAT_TYPES = (10, 11)
+
 FORMAT_TYPES = {
     4: 'B', # PT_8BUI
     5: 'h', # PT_16BSI
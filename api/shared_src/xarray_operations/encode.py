@@ -1,9 +1,175 @@
 import xarray as xr
+import numpy as np
 import binascii
+import math
 import struct
+from typing import Dict, Iterator, Literal, Optional, Tuple, overload
 from .sizes import transform
 from . import dtypes
 
+# Endiannes, Version, Bands, Scale (x, y), Upper left corner (x, y), Skew (x, y), SRID, Columns, Rows
+RASTER_HEADER = struct.Struct('<BHHddddddiHH')
+# Pixel type and nodata value for each WKT raster pixel type
+BAND_HEADERS = {pixeltype: struct.Struct('<B' + fmt) for pixeltype, fmt in dtypes.FORMAT_TYPES.items()}
+
+GeoTransform = Tuple[float, float, float, float, float, float]
+
+@overload
+def dataset_to_wkb(dataset: xr.Dataset, srid: int, as_hex: Literal[False] = ..., geotransform: Optional[GeoTransform] = ...) -> bytearray:
+    ...
+@overload
+def dataset_to_wkb(dataset: xr.Dataset, srid: int, as_hex: Literal[True], geotransform: Optional[GeoTransform] = ...) -> str:
+    ...
+def dataset_to_wkb(dataset: xr.Dataset, srid: int, as_hex: bool = False, geotransform: Optional[GeoTransform] = None) -> bytearray | str:
+    """
+    Encodes a dataset into WKB for WKT rasters.
+    The header and all bands are written into a single preallocated buffer.
+    If as_hex is True the buffer is returned as a HEX-encoded string.
+    The geotransform is computed from the coordinates unless it is given (e.g. for tiles, see tile_dataset).
+    """
+    xsize, ysize = dataset.sizes.values()
+    bands = [(dataset[key], dtypes.numpy_dtype_to_wkt_raster_id(str(dataset[key].dtype))) for key in dataset.data_vars]
+    size = RASTER_HEADER.size + sum(BAND_HEADERS[pixeltype].size + band.nbytes for band, pixeltype in bands)
+    buffer = bytearray(size)
+
+    # Header
+    gt = transform(dataset) if geotransform is None else geotransform
+    RASTER_HEADER.pack_into(
+        buffer, 0,
+        1, # 1 = Little-endian
+        0, # 0 = WKTRaster version
+        len(bands),
+        gt[1], gt[5], # Scale
+        gt[0], gt[3], # Upper left corner
+        gt[2], gt[4], # Skew
+        srid,
+        xsize, ysize
+    )
+    position = RASTER_HEADER.size
+
+    # Band header and data
+    for band, pixeltype in bands:
+        band_header = BAND_HEADERS[pixeltype]
+        flags, nodata = band_nodata(band, pixeltype)
+        band_header.pack_into(buffer, position, flags + pixeltype, nodata)
+        position += band_header.size
+        write_band(band, buffer, position)
+        position += band.nbytes
+
+    if as_hex:
+        return buffer.hex()
+    return buffer
+
+def tile_dataset(dataset: xr.Dataset, tile_size: int) -> Iterator[Tuple[int, int, xr.Dataset, GeoTransform]]:
+    """
+    Splits a dataset into tiles of tile_size x tile_size pixels (smaller along the edges).
+    Yields (row, column, tile, geotransform) where row is the index of the tile along the first dimension
+    and column along the second. The geotransform is derived from the one of the whole dataset,
+    since tiles which are one pixel wide have no resolution of their own.
+    """
+    xsize, ysize = dataset.sizes.values()
+    x_dim, y_dim = list(dataset.sizes)
+    left, scale_x, skew_x, top, skew_y, scale_y = transform(dataset)
+    for row, x in enumerate(range(0, xsize, tile_size)):
+        for column, y in enumerate(range(0, ysize, tile_size)):
+            tile = dataset.isel({x_dim: slice(x, x + tile_size), y_dim: slice(y, y + tile_size)})
+            height = tile.sizes[y_dim]
+            # The second dimension is stored from the end of the raster (see decode.raster_coordinates)
+            geotransform = (left + x * scale_x, scale_x, skew_x, top + (ysize - y - height) * scale_y, skew_y, scale_y)
+            yield row, column, tile, geotransform
+
+def band_nodata(band: xr.DataArray, pixeltype: int) -> Tuple[int, int | float]:
+    """
+    Flags (64 = has nodata) and nodata value of the band header.
+    The nodata value is the _FillValue of the band (e.g. packed bands), NaN for floating point bands
+    and integer bands without a _FillValue have no nodata value.
+    """
+    nodata = band.attrs.get('_FillValue')
+    if nodata is None and pixeltype in dtypes.FLOAT_TYPES:
+        nodata = math.nan
+    if nodata is None:
+        return 0, 0
+    return 64, nodata
+
+def pack_band(band: xr.DataArray) -> xr.DataArray:
+    """
+    Packs a floating point band as int16 with a scale_factor and add_offset (CF conventions).
+    The range of the finite values is mapped to -32767..32767 and NaN is stored as the nodata value (-32768),
+    so the precision is (max - min) / 65534.
+    """
+    pixels = band.values
+    finite = np.isfinite(pixels)
+    if finite.any():
+        minimum, maximum = float(pixels[finite].min()), float(pixels[finite].max())
+    else:
+        minimum = maximum = 0.0
+    add_offset = (maximum + minimum) / 2
+    scale_factor = (maximum - minimum) / (2 * dtypes.PACKED_MAX) or 1.0
+    packed = np.full(pixels.shape, dtypes.PACKED_NODATA, dtype=dtypes.PACKED_DTYPE)
+    packed[finite] = np.clip(np.rint((pixels[finite] - add_offset) / scale_factor), -dtypes.PACKED_MAX, dtypes.PACKED_MAX)
+    attrs = {
+        **band.attrs,
+        'scale_factor': scale_factor,
+        'add_offset': add_offset,
+        '_FillValue': np.int16(dtypes.PACKED_NODATA)
+    }
+    return xr.DataArray(packed, dims=band.dims, coords=band.coords, attrs=attrs, name=band.name)
+
+def pack_dataset(dataset: xr.Dataset) -> xr.Dataset:
+    """Packs the floating point bands of a dataset as int16 (see pack_band). Other bands are kept as they are."""
+    return dataset.assign({
+        key: pack_band(dataset[key]) for key in dataset.data_vars if np.issubdtype(dataset[key].dtype, np.floating)
+    })
+
+def packing_attributes(dataset: xr.Dataset) -> Dict[str, Tuple[float, float]]:
+    """(scale_factor, add_offset) of the packed bands of a dataset"""
+    return {
+        str(key): (float(band.attrs['scale_factor']), float(band.attrs['add_offset']))
+        for key, band in dataset.data_vars.items() if 'scale_factor' in band.attrs
+    }
+
+def raster_order(pixels: np.ndarray) -> np.ndarray:
+    """
+    View of (lat, lon) pixels in the order PostGIS reads them (inverse of decode.dataset_order).
+    The latitude is along the x-axis and the longitude along the y-axis with a negative scale (see sizes.transform),
+    so each row is one longitude starting from the largest and the latitude varies fastest within a row.
+    """
+    return pixels[:, ::-1].T
+
+def write_band(band: xr.DataArray, buffer: bytearray, position: int) -> None:
+    """Writes the pixels of the band as little-endian in raster order (see raster_order) directly into the buffer at position."""
+    pixels = band.values
+    if pixels is None:
+        raise ValueError("Invalid array was read from band")
+    pixels = raster_order(pixels)
+    view = np.ndarray(
+        pixels.shape,
+        dtype=pixels.dtype.newbyteorder('<'),
+        buffer=memoryview(buffer)[position:position + pixels.nbytes]
+    )
+    view[...] = pixels
+
+def relayout_wkb(wkb: bytes | memoryview) -> bytearray:
+    """
+    Rewrites WKB of a raster with the pixels in the (lat, lon) order of the arrays (layout 0, see dtypes.RASTER_LAYOUT)
+    in raster order (see raster_order). The header is unchanged, since it was already the PostGIS one.
+    """
+    buffer = bytearray(wkb)
+    endian, _, bands, *_, width, height = RASTER_HEADER.unpack_from(buffer, 0)
+    if endian != 1:
+        raise ValueError("Only little-endian rasters can be rewritten")
+    position = RASTER_HEADER.size
+    for _ in range(bands):
+        pixeltype = buffer[position] & 15
+        position += BAND_HEADERS[pixeltype].size
+        dtype = np.dtype(dtypes.FORMAT_TYPES[pixeltype]).newbyteorder('<')
+        nbytes = width * height * dtype.itemsize
+        pixels = np.frombuffer(bytes(buffer[position:position + nbytes]), dtype=dtype).reshape(width, height)
+        view = np.ndarray((height, width), dtype=dtype, buffer=memoryview(buffer)[position:position + nbytes])
+        view[...] = raster_order(pixels)
+        position += nbytes
+    return buffer
+
 def dataset_to_hexwkb(dataset: xr.Dataset, srid: int) -> bytes:
     """Encodes a dataset into HEX-encoded WKB for WKT rasters."""
     # Header in bytes 
@@ -17,11 +183,11 @@ def dataset_to_hexwkb(dataset: xr.Dataset, srid: int) -> bytes:
     return hexwkb
 
 def wkblify_band(band: xr.DataArray) -> bytes:
-    """Writes band of given xr.DataArray into HEX-encoded WKB for WKT Raster output."""
+    """Writes band of given xr.DataArray into HEX-encoded WKB for WKT Raster output (in raster order, see raster_order)."""
     pixels = band.values
     if pixels is None:
         raise ValueError("Invalid array was read from band")
-    return binascii.hexlify(pixels) # type: ignore
+    return binascii.hexlify(np.ascontiguousarray(raster_order(pixels))) # type: ignore
 
 def raster_header_to_hexwkb(dataset: xr.Dataset, srid: int) -> bytes:
     """Encodes the header of the dataset to a hexwkb format"""
@@ -62,9 +228,9 @@ def band_header_to_hexwkb(data_array: xr.DataArray) -> bytes:
     pixeltype = dtypes.numpy_dtype_to_wkt_raster_id(str(data_array.dtype))
 
     # Encodes pixel and nodata value
-    # It has been assumed there is data it every point
-    hexwkb = wkblify('B', 64 + pixeltype)
-    hexwkb += wkblify(dtypes.pt2fmt(pixeltype), 0)
+    flags, nodata = band_nodata(data_array, pixeltype)
+    hexwkb = wkblify('B', flags + pixeltype)
+    hexwkb += wkblify(dtypes.pt2fmt(pixeltype), nodata)
     return hexwkb
 
 def wkblify(fmt: str, data: int | float) -> bytes:
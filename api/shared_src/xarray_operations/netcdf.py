@@ -0,0 +1,23 @@
+from typing import Iterable, Iterator, Optional, Tuple
+import xarray as xr
+from .. import archive, parallel, timing
+
+def netcdf_file(grid: xr.Dataset) -> Tuple[str, bytes | memoryview]:
+    """Encodes a grid as a NetCDF file (name, data) named after the date of the grid. xarray returns the data as a memoryview"""
+    file_name = str(grid.time.data).split('T')[0]
+    with timing.measure("netcdf") as measurement:
+        data = grid.to_netcdf(None, engine='scipy')
+        measurement.nbytes = len(data)
+    return f"{file_name}.nc", data
+
+def netcdf_entries(grids: Iterable[xr.Dataset]) -> Iterator[Tuple[str, bytes | memoryview]]:
+    """Encodes one grid at a time and yields it as a NetCDF file (name, data) named after the date of the grid"""
+    for grid in grids:
+        yield netcdf_file(grid)
+
+def compressed_netcdf_entries(grids: Iterable[xr.Dataset], workers: Optional[int] = None) -> Iterator[archive.Compressed]:
+    """
+    Encodes and compresses the grids in a thread pool (see parallel.ordered_map) and yields
+    the compressed NetCDF files ordered like the grids, ready to be copied into an archive.
+    """
+    return parallel.ordered_map(lambda grid: archive.compress(*netcdf_file(grid)), grids, workers)
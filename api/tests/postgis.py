@@ -0,0 +1,81 @@
+"""
+The rasters have to follow the pixel to world convention of PostGIS, since ST_Clip, ST_Value,
+ST_SummaryStats and ST_PixelAsCentroids read them in the database. The helpers below read the WKB the way
+PostGIS does (row-major, x varies fastest and the rows go from the top) independently of decode.
+evaluate runs the expressions of a query on the pixels with numpy, since the tests do not need a database.
+"""
+import struct
+from functools import reduce
+from typing import Any, Dict
+import numpy as np
+import xarray as xr
+from sqlalchemy.sql import elements, functions, operators
+
+HEADER = struct.Struct('<BHHddddddiHH')
+
+def make_dataset() -> xr.Dataset:
+    """Grid where each pixel is lat * 1000 + lon, so the value of a pixel tells where it is"""
+    lats = np.arange(-9.5, 10, 1.0)
+    lons = np.arange(0.5, 30, 1.0)
+    values = lats[:, None] * 1000 + lons[None, :]
+    return xr.Dataset(
+        data_vars={
+            'sla': (['lats', 'lons'], values.astype('float64')),
+            'sst': (['lats', 'lons'], -values.astype('float32'))
+        },
+        coords=dict(lats=lats, lons=lons)
+    )
+
+def postgis_band(wkb: bytes, band: int) -> np.ndarray:
+    """Pixels of a band (0-based) as (row, column) like PostGIS reads them"""
+    _, _, _, _, _, _, _, _, _, _, width, height = HEADER.unpack_from(wkb, 0)
+    position = HEADER.size
+    for index in range(band + 1):
+        pixeltype = wkb[position] & 15
+        dtype = np.dtype({5: '<i2', 10: '<f4', 11: '<f8'}[pixeltype])
+        position += 1 + dtype.itemsize
+        if index == band:
+            return np.frombuffer(wkb, dtype=dtype, count=width * height, offset=position).reshape(height, width)
+        position += width * height * dtype.itemsize
+    raise IndexError(band)
+
+def postgis_centroids(wkb: bytes) -> tuple:
+    """World coordinates (x, y) of the pixel centers as (row, column) arrays"""
+    _, _, _, scale_x, scale_y, ip_x, ip_y, _, _, _, width, height = HEADER.unpack_from(wkb, 0)
+    columns, rows = np.meshgrid(np.arange(width), np.arange(height))
+    return ip_x + (columns + 0.5) * scale_x, ip_y + (rows + 0.5) * scale_y
+
+def postgis_value(wkb: bytes, band: int, x: float, y: float) -> float:
+    """ST_Value of a point"""
+    _, _, _, scale_x, scale_y, ip_x, ip_y, *_ = HEADER.unpack_from(wkb, 0)
+    column, row = int(np.floor((x - ip_x) / scale_x)), int(np.floor((y - ip_y) / scale_y))
+    return float(postgis_band(wkb, band)[row, column])
+
+AGGREGATES = {'count': np.size, 'sum': np.sum, 'min': np.min, 'max': np.max}
+FUNCTIONS = {'cos': np.cos, 'radians': np.radians, 'sqrt': np.sqrt, 'greatest': np.maximum, 'st_x': lambda x: x}
+OPERATORS = {operators.add: np.add, operators.sub: np.subtract, operators.mul: np.multiply, operators.truediv: np.true_divide}
+
+def evaluate(expression: Any, columns: Dict[str, np.ndarray]) -> Any:
+    """
+    Evaluates a SQL expression over the rows of a query with numpy, so the expressions of a query are run
+    without a database. columns are the values of the columns by name (a point column is given as its x).
+    Only the functions and operators used by the queries are supported.
+    """
+    if isinstance(expression, (elements.Label, elements.Grouping)):
+        return evaluate(expression.element, columns)
+    if isinstance(expression, elements.Cast):
+        return evaluate(expression.clause, columns)
+    if isinstance(expression, elements.BindParameter):
+        return expression.value
+    if isinstance(expression, elements.ColumnClause):
+        return columns[expression.name]
+    if isinstance(expression, elements.BinaryExpression):
+        return OPERATORS[expression.operator](evaluate(expression.left, columns), evaluate(expression.right, columns))
+    if isinstance(expression, elements.ExpressionClauseList):
+        # Chains of the same operator (a * b * c)
+        return reduce(OPERATORS[expression.operator], [evaluate(clause, columns) for clause in expression.clauses])
+    if isinstance(expression, functions.FunctionElement):
+        name = expression.name.lower()
+        arguments = [evaluate(argument, columns) for argument in expression.clauses]
+        return (AGGREGATES.get(name) or FUNCTIONS[name])(*arguments)
+    raise NotImplementedError(type(expression))
@@ -0,0 +1,27 @@
+"""Keys and files of the precomputed NetCDF files of add_grids"""
+import io
+import zlib
+from datetime import datetime
+import pytest
+import xarray as xr
+from shared_src.databases import tables
+from shared_src.databases.database import Database
+from shared_src.xarray_operations import encode
+from .postgis import make_dataset
+
+def test_key_is_in_the_order_of_the_bands():
+    assert Database._artifact_variables(['sst', 'sla']) == Database._artifact_variables(['sla', 'sst']) == 'sla,sst'
+    assert Database._artifact_variables(None) == 'sla,sst,swh,wind_speed'
+
+def test_unknown_variables_are_rejected():
+    with pytest.raises(ValueError):
+        Database._artifact_variables(['sla', 'height'])
+
+def test_file_has_the_variables_in_the_order_of_the_bands():
+    grid = tables.Grid(resolution_id=1, date=datetime(2020, 1, 1))
+    grid.raster_wkb = bytes(encode.dataset_to_wkb(make_dataset(), srid=4326))
+    row, = Database._artifact_rows(grid, [['sst', 'sla']])
+    assert row['variables'] == 'sla,sst'
+    # The files are raw deflate (see archive.compress)
+    data = zlib.decompress(row['data'], -15)
+    assert list(xr.open_dataset(io.BytesIO(data), engine='scipy').data_vars) == ['sla', 'sst']
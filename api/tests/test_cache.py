@@ -0,0 +1,51 @@
+"""Grid cache of getData"""
+from datetime import date
+import numpy as np
+import xarray as xr
+from shared_src import cache
+from shared_src.xarray_operations.dtypes import BANDS
+
+DAY = date(2020, 1, 1)
+
+def make_grid(variables):
+    return xr.Dataset({name: (['lats', 'lons'], np.zeros((2, 3))) for name in variables})
+
+def test_subset_is_not_served_for_all_variables():
+    grids = cache.GridCache(1024 ** 2)
+    grids.put(1, DAY, make_grid(['sst']))
+    assert grids.get(1, DAY) is None
+    assert grids.get_range(1, DAY, DAY) == {}
+    assert (grid := grids.get(1, DAY, ['sst'])) is not None
+    assert list(grid.data_vars) == ['sst']
+
+def test_all_variables_serve_subsets():
+    grids = cache.GridCache(1024 ** 2)
+    grids.put(1, DAY, make_grid(BANDS))
+    assert (grid := grids.get(1, DAY)) is not None
+    assert list(grid.data_vars) == BANDS
+    assert list(grids.get_range(1, DAY, DAY, ['swh', 'sla'])[DAY].data_vars) == ['swh', 'sla']
+
+def test_get_range_does_not_count():
+    grids = cache.GridCache(1024 ** 2)
+    grids.put(1, DAY, make_grid(BANDS))
+    grids.get_range(1, DAY, DAY)
+    assert (grids.stats()['hits'], grids.stats()['misses']) == (0, 0)
+
+def test_replaced_grids_are_dropped():
+    grids = cache.GridCache(1024 ** 2)
+    grids.put(1, DAY, make_grid(BANDS), '100')
+    assert DAY in grids.get_range(1, DAY, DAY, None, {DAY: '100'})
+    assert grids.get_range(1, DAY, DAY, None, {DAY: '101'}) == {}
+    assert grids.stats()['grids'] == 0
+
+def test_deleted_grids_are_dropped():
+    grids = cache.GridCache(1024 ** 2)
+    grids.put(1, DAY, make_grid(BANDS), '100')
+    assert grids.get_range(1, DAY, DAY, None, {}) == {}
+    assert grids.stats()['grids'] == 0
+
+def test_grids_expire():
+    grids = cache.GridCache(1024 ** 2, max_age=0)
+    grids.put(1, DAY, make_grid(BANDS))
+    assert grids.get_range(1, DAY, DAY) == {}
+    assert grids.get(1, DAY) is None
@@ -0,0 +1,55 @@
+"""Queue of the export jobs and the ranged downloads of GetExport"""
+import os
+import time
+from datetime import date
+import pytest
+from GetExport import parse_range
+from shared_src import exports
+
+REQUEST = exports.ExportRequest(1, "res", date(2020, 1, 1), date(2020, 1, 31))
+
+@pytest.mark.parametrize('header, expected', [
+    (None, (0, 99)),
+    ('bytes=0-9', (0, 9)),
+    ('bytes=90-', (90, 99)),
+    ('bytes=-10', (90, 99)),
+    ('bytes=-500', (0, 99)),
+    ('bytes=0-500', (0, 99)),
+    ('bytes=-0', None),
+    ('bytes=100-', None),
+    ('bytes=9-0', None),
+    ('bytes=-', None),
+    ('lines=0-9', None)
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+def test_claimed_job_is_reused_while_it_starts(tmp_path):
+    store = exports.ExportStore(tmp_path)
+    job_id = store.submit(REQUEST)["job_id"]
+    assert store.claim() == job_id
+    assert store.submit(REQUEST)["state"] == exports.QUEUED
+    assert store.claim() is None
+
+def test_claimed_job_of_stopped_worker_is_queued_again(tmp_path):
+    store = exports.ExportStore(tmp_path)
+    job_id = store.submit(REQUEST)["job_id"]
+    assert store.claim() == job_id
+    # The worker stopped after the claim, before the job was running
+    claimed = store.queue / f"{job_id}.claimed"
+    old = time.time() - exports.STALE_SECONDS - 1
+    os.utime(claimed, (old, old))
+    store.submit(REQUEST)
+    assert not claimed.exists()
+    assert store.claim() == job_id
+
+def test_claim_time_is_not_the_queue_time(tmp_path):
+    store = exports.ExportStore(tmp_path)
+    job_id = store.submit(REQUEST)["job_id"]
+    # The job waited in the queue for longer than STALE_SECONDS before it was claimed
+    queued = store.queue / f"{job_id}.json"
+    old = time.time() - exports.STALE_SECONDS - 1
+    os.utime(queued, (old, old))
+    assert store.claim() == job_id
+    store.submit(REQUEST)
+    assert store.claim() is None
@@ -0,0 +1,46 @@
+"""Encoding and decoding of the rasters against the pixel to world convention of PostGIS (see postgis)"""
+import numpy as np
+from shared_src.xarray_operations import decode, encode
+from .postgis import HEADER, make_dataset, postgis_band, postgis_centroids
+
+def test_pixels_follow_postgis_convention():
+    dataset = make_dataset()
+    wkb = bytes(encode.dataset_to_wkb(dataset, srid=4326))
+    x, y = postgis_centroids(wkb)
+    # The latitude is along the x-axis and the longitude along the y-axis
+    np.testing.assert_array_equal(postgis_band(wkb, 0), x * 1000 + y)
+    np.testing.assert_array_equal(postgis_band(wkb, 1), -(x * 1000 + y))
+
+def test_hex_encoding_matches_binary():
+    dataset = make_dataset()
+    assert bytes.fromhex(encode.dataset_to_hexwkb(dataset, srid=4326).decode()) == bytes(encode.dataset_to_wkb(dataset, srid=4326))
+
+def test_round_trip():
+    dataset = make_dataset()
+    decoded = decode.read_wkb_raster(bytes(encode.dataset_to_wkb(dataset, srid=4326)))
+    lats, lons = decode.raster_coordinates(decoded)
+    np.testing.assert_allclose(lats, dataset['lats'])
+    np.testing.assert_allclose(lons, dataset['lons'])
+    for band, name in zip(decoded['bands'], dataset.data_vars):
+        np.testing.assert_array_equal(band['ndarray'], dataset[name].values)
+
+def test_tiles_follow_postgis_convention():
+    dataset = make_dataset()
+    for _, _, tile, geotransform in encode.tile_dataset(dataset, 7):
+        wkb = bytes(encode.dataset_to_wkb(tile, srid=4326, geotransform=geotransform))
+        x, y = postgis_centroids(wkb)
+        np.testing.assert_allclose(postgis_band(wkb, 0), x * 1000 + y)
+
+def test_relayout_of_old_rasters():
+    dataset = make_dataset()
+    wkb = bytes(encode.dataset_to_wkb(dataset, srid=4326))
+    # Old rasters have the header of the new ones and the pixels in (lat, lon) order
+    old = bytearray(wkb)
+    position = HEADER.size
+    for name in dataset.data_vars:
+        pixels = dataset[name].values
+        position += 1 + pixels.dtype.itemsize
+        old[position:position + pixels.nbytes] = pixels.astype(pixels.dtype.newbyteorder('<')).tobytes()
+        position += pixels.nbytes
+    assert bytes(old) != wkb
+    assert bytes(encode.relayout_wkb(bytes(old))) == wkb
@@ -0,0 +1,64 @@
+"""Grids clipped to a bounding box by regional getData requests, for days stored with and without tiles"""
+import io
+import zlib
+from datetime import datetime
+from types import SimpleNamespace
+import numpy as np
+import xarray as xr
+from getData import regional_entries
+from shared_src.databases.database import BoundingBox
+from shared_src.xarray_operations import encode
+from .postgis import make_dataset, postgis_centroids
+
+# Not on the edges (or centers) of the 1 degree pixels
+BBOX = BoundingBox(-3.3, 4.7, 10.2, 17.9)
+TILED = datetime(2020, 1, 2)
+UNTILED = datetime(2020, 1, 1)
+
+def grid_row(day: datetime, wkb=None) -> SimpleNamespace:
+    return SimpleNamespace(raster_wkb=wkb, date=day, references='test')
+
+def clipped(dataset: xr.Dataset) -> bytes:
+    """WKB of the pixels ST_Clip keeps of the bounding box (the pixels with their center inside it)"""
+    x, y = postgis_centroids(bytes(encode.dataset_to_wkb(dataset, srid=4326)))
+    lats, lons = x[0], y[::-1, 0]
+    keep_lats = (lats >= BBOX.min_lat) & (lats <= BBOX.max_lat)
+    keep_lons = (lons >= BBOX.min_lon) & (lons <= BBOX.max_lon)
+    return bytes(encode.dataset_to_wkb(dataset.isel(lats=keep_lats, lons=keep_lons), srid=4326))
+
+def intersecting_tiles(dataset: xr.Dataset, tile_size: int) -> list:
+    """Tiles which overlap the bounding box (the && filter of iter_tiled_grids)"""
+    tiles = []
+    for row, column, tile, geotransform in encode.tile_dataset(dataset, tile_size):
+        lats, lons = tile['lats'].values, tile['lons'].values
+        if lats[0] - 0.5 <= BBOX.max_lat and lats[-1] + 0.5 >= BBOX.min_lat and lons[0] - 0.5 <= BBOX.max_lon and lons[-1] + 0.5 >= BBOX.min_lon:
+            wkb = bytes(encode.dataset_to_wkb(tile, srid=4326, geotransform=geotransform))
+            tiles.append(SimpleNamespace(tile_row=row, tile_column=column, raster_wkb=wkb))
+    return tiles
+
+class Database:
+    """A day which is clipped in the database and a day which is stored as tiles"""
+    def __init__(self, dataset: xr.Dataset) -> None:
+        self.dataset = dataset
+
+    def get_tile_dates(self, *args):
+        return [TILED]
+
+    def get_grid_dates(self, *args):
+        return [UNTILED, TILED]
+
+    def iter_grids_by_resolution_and_dates(self, dates, **kwargs):
+        assert dates == [UNTILED]
+        yield grid_row(UNTILED, clipped(self.dataset))
+
+    def iter_tiled_grids(self, *args):
+        yield grid_row(TILED), intersecting_tiles(self.dataset, 4)
+
+def test_tiled_and_untiled_days_have_the_same_pixels():
+    dataset = make_dataset()
+    entries = list(regional_entries(Database(dataset), 1, UNTILED.date(), TILED.date(), BBOX, None))  # type: ignore[arg-type]
+    untiled, tiled = (xr.open_dataset(io.BytesIO(zlib.decompress(entry.data, -15)), engine='scipy') for entry in entries)
+    assert np.array_equal(untiled['Latitude'], np.arange(-2.5, 5, 1.0))
+    assert np.array_equal(untiled['Longitude'], np.arange(10.5, 18, 1.0))
+    for name in ('Latitude', 'Longitude', 'sla', 'sst'):
+        assert np.array_equal(untiled[name].values, tiled[name].values)
@@ -0,0 +1,98 @@
+"""Regional statistics of GetStatistics (see postgis)"""
+from datetime import date
+import numpy as np
+import pytest
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql
+from shared_src.databases.database import BoundingBox, Database
+from shared_src.xarray_operations import encode
+from .postgis import evaluate, make_dataset, postgis_band, postgis_centroids
+
+REGION = (-5, 8, 10, 20)
+
+def region_pixels(wkb: bytes, band: int) -> tuple:
+    """(latitudes, values) of the pixels with their centroid in REGION paired like ST_PixelAsCentroids"""
+    min_lat, max_lat, min_lon, max_lon = REGION
+    x, y = postgis_centroids(wkb)
+    inside = (x > min_lat) & (x < max_lat) & (y > min_lon) & (y < max_lon)
+    return x[inside], postgis_band(wkb, band)[inside].astype('float64')
+
+def band_statistics(wkb: bytes, band: int, weighted: bool) -> list:
+    """Runs the expressions of Database._band_statistics on the pixels of the band in REGION"""
+    lats, values = region_pixels(wkb, band)
+    query = Database._band_statistics(func.ST_RastFromWKB(wkb), band + 1, weighted).element.element
+    return [evaluate(column, dict(geom=lats, val=values)) for column in query.selected_columns]
+
+def reference(values: np.ndarray, lats: np.ndarray) -> dict:
+    """Area weighted statistics with numpy"""
+    weights = np.broadcast_to(np.cos(np.radians(lats))[:, None], values.shape)
+    mean = np.average(values, weights=weights)
+    stddev = np.sqrt(np.average((values - mean) ** 2, weights=weights))
+    return dict(count=values.size, mean=mean, stddev=stddev, min=values.min(), max=values.max())
+
+def test_weighted_statistics_of_region():
+    dataset = make_dataset()
+    wkb = bytes(encode.dataset_to_wkb(dataset, srid=4326))
+    min_lat, max_lat, min_lon, max_lon = REGION
+    region = dataset['sla'].sel(lats=slice(min_lat, max_lat), lons=slice(min_lon, max_lon))
+    statistics = Database._unpack_statistics(band_statistics(wkb, 0, True), None)
+    expected = reference(region.values, region['lats'].values)
+    assert statistics['count'] == expected['count']
+    for key in ('mean', 'stddev', 'min', 'max'):
+        assert statistics[key] == pytest.approx(expected[key])
+
+def test_weighted_statistics_of_packed_region():
+    dataset = make_dataset()
+    packed = encode.pack_dataset(dataset)
+    scale = encode.packing_attributes(packed)['sla']
+    wkb = bytes(encode.dataset_to_wkb(packed, srid=4326))
+    min_lat, max_lat, min_lon, max_lon = REGION
+    region = dataset['sla'].sel(lats=slice(min_lat, max_lat), lons=slice(min_lon, max_lon))
+    statistics = Database._unpack_statistics(band_statistics(wkb, 0, True), scale)
+    expected = reference(region.values, region['lats'].values)
+    for key in ('mean', 'stddev', 'min', 'max'):
+        assert statistics[key] == pytest.approx(expected[key], abs=scale[0])
+
+def test_statistics_of_no_pixels():
+    assert Database._unpack_statistics([0, None, None, None, None], None) == dict(count=0, mean=None, stddev=None, min=None, max=None)
+
+def test_weighted_statistics_are_double_precision():
+    sql = str(Database._band_statistics(func.ST_RastFromWKB(b''), 1, True).element.compile(dialect=postgresql.dialect()))
+    assert 'ST_PixelAsCentroids' in sql and 'cos(radians(ST_X(' in sql
+    assert 'NUMERIC' not in sql
+
+class Session:
+    """Session which records the statements instead of running them"""
+    def __init__(self) -> None:
+        self.statements = []
+
+    def __call__(self, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def begin(self):
+        return self
+
+    def execute(self, statement):
+        self.statements.append(statement)
+        return self
+
+    def all(self) -> list:
+        return []
+
+def test_statistics_of_each_band_are_in_order():
+    database = Database.__new__(Database)
+    session = Session()
+    setattr(database, 'session', session)
+    database.get_statistics(1, date(2020, 1, 1), date(2020, 1, 31), BoundingBox(*REGION), ['swh', 'sla'], True)
+    statement, = session.statements
+    sql = str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    # ST_Band picks the variables and the band statistics read the bands of the clipped raster in that order
+    assert 'ST_Band(grid.raster, ARRAY[3, 1])' in sql
+    assert [column.name for column in statement.selected_columns][2:] == list(Database.STATISTICS) * 2
+    assert sql.count('ST_PixelAsCentroids') == 2
@@ -0,0 +1,30 @@
+"""Values at a point (ST_Value) of GetTimeSeries (see postgis)"""
+import math
+import pytest
+from shared_src.databases.database import Database
+from shared_src.xarray_operations import encode
+from .postgis import make_dataset, postgis_value
+
+@pytest.mark.parametrize('lat, lon', [(-1.5, 12.5), (-9.5, 0.5), (9.5, 29.5), (3.2, 17.9)])
+def test_value_at_point(lat, lon):
+    dataset = make_dataset()
+    wkb = bytes(encode.dataset_to_wkb(dataset, srid=4326))
+    expected = dataset['sla'].sel(lats=lat, lons=lon, method='nearest').item()
+    assert postgis_value(wkb, 0, lat, lon) == expected
+
+def test_known_point():
+    # The point is the x (latitude) and y (longitude) of ST_MakePoint
+    wkb = bytes(encode.dataset_to_wkb(make_dataset(), srid=4326))
+    assert postgis_value(wkb, 0, -1.5, 12.5) == -1487.5
+    assert postgis_value(wkb, 1, -1.5, 12.5) == 1487.5
+
+def test_packed_value_at_point():
+    dataset = encode.pack_dataset(make_dataset())
+    scales = encode.packing_attributes(dataset)
+    wkb = bytes(encode.dataset_to_wkb(dataset, srid=4326))
+    value = Database._unpack_value(postgis_value(wkb, 0, -1.5, 12.5), scales['sla'])
+    assert value == pytest.approx(-1487.5, abs=scales['sla'][0])
+
+def test_nodata_is_none():
+    assert Database._unpack_value(None, None) is None
+    assert Database._unpack_value(math.nan, (0.1, 0.0)) is None
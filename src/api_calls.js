@@ -1,42 +1,84 @@
-function base64_to_array_buffer(base64) {
-    var binaryString = window.atob(base64);
-    var binaryLen = binaryString.length;
-    var bytes = new Uint8Array(binaryLen);
-    for (var i = 0; i < binaryLen; i++) {
-       var ascii = binaryString.charCodeAt(i);
-       bytes[i] = ascii;
-    }
-    return bytes;
- }
-
- function save_byte_array(fileName, bytes) {
-    var blob = new Blob([bytes], {type: "application/zip"});
+function save_blob(fileName, blob) {
     var link = document.createElement('a');
     link.href = window.URL.createObjectURL(blob);
     link.download = fileName;
     link.click();
+    setTimeout(() => window.URL.revokeObjectURL(link.href), 0);
 };
 
+function attachment_name(response, fallback) {
+    var disposition = response.headers.get("Content-Disposition");
+    var match = disposition && disposition.match(/filename="?([^";]+)"?/);
+    return match ? match[1] : fallback;
+}
+
 async function get_grids(resolution_name, product_name, start_date, end_date) {
-    const URL = `/api/GetData?resolution_name=${resolution_name}&product_name=${product_name}&start_date=${start_date}&end_date=${end_date}`;
+    const URL = `/api/GetData?resolution_name=${resolution_name}&product_name=${product_name}&start_date=${start_date}&end_date=${end_date}&encoding=binary`;
     // Process data from api
     await fetch(URL)
-    .then(response => {
+    .then(async response => {
         if (response.status == 200) {
-            return response.text();
+            var file_name = attachment_name(response, "AltimetryGridding.zip");
+            return save_blob(file_name, await response.blob());
         }
         throw new Error(response);
     })
-    .then(file => {
-        var buffer = base64_to_array_buffer(file);
-        save_byte_array("AltimetryGridding.zip", buffer);
-    })
     .catch(err => {});
     var download_button = document.querySelector(".download_button");
     download_button.onclick = download;
     download_button.textContent = "Download";
 }
 
+async function get_available_dates(resolution_name) {
+    const URL = `/api/GetAvailableDates?resolution_name=${resolution_name}`;
+    // Process data from api
+    return await fetch(URL)
+    .then(response => {
+        if (response.status == 200) {
+            return response.json();
+        }
+        throw new Error(response);
+    })
+    .then(dates => {
+        if(dates['status'] === "success"){
+            return dates;
+        }
+        throw new Error(dates);
+    })
+    .catch(err => null);
+}
+
+function days_between(start_date, end_date){
+    return Math.round((Date.parse(end_date) - Date.parse(start_date)) / 86400000);
+}
+
+function is_available(date){
+    // All dates are available until the available dates of the resolution are known
+    if (!available_dates){
+        return true;
+    }
+    return available_dates['ranges'].some(([start, end]) =>
+        start <= date && date <= end && days_between(start, date) % available_dates['step'] == 0
+    );
+}
+
+function has_available_dates(start_date, end_date){
+    if (!available_dates){
+        return true;
+    }
+    var step = available_dates['step'];
+    return available_dates['ranges'].some(([start, end]) => {
+        var first = start_date > start ? start_date : start;
+        var last = end_date < end ? end_date : end;
+        if (first > last){
+            return false;
+        }
+        // First date in the range which is a multiple of step days after the start of the range
+        var offset = Math.ceil(days_between(start, first) / step) * step;
+        return offset <= days_between(start, last);
+    });
+}
+
 async function get_products() {
     const URL ='/api/GetProducts?resolution=true';
     // Process data from api
@@ -118,11 +160,15 @@ function make_resolution(product){
     };
     dropdown.replaceChildren(...elements_a)
 }
-function set_resolution(resolution){
+async function set_resolution(resolution){
     document.querySelector('#resolution-dropdown-input').checked = false;
     var resolution_label = document.querySelector('#resolution-dropdown-label');
     resolution_label.textContent = resolution;
     resolution_label.dataset.resolution = resolution;
+    available_dates = null;
+    check_download_button();
+    available_dates = await get_available_dates(resolution);
+    refresh_calenders();
     check_download_button();
 }
 
@@ -145,6 +191,13 @@ function check_download_button(){
         download_button.style.display = "none";
         return;
     }
+    // Nothing to download if there are no grids between the dates
+    var start_date = document.querySelector('#start-date div a').dataset.date;
+    var end_date = document.querySelector('#end-date div a').dataset.date;
+    if (!has_available_dates(start_date, end_date)){
+        download_button.style.display = "none";
+        return;
+    }
     download_button.style.display = "";
     download_button.onclick = download;
 }
@@ -162,6 +215,7 @@ function download(){
 
 
 var product;
+var available_dates = null;
 async function setup(){
     products = await get_products();
     make_product_dropdowns(products);
@@ -74,15 +74,8 @@ function CalendarControl(id) {
         monthLabel.innerHTML = calendarControl.calMonthName[calendar.getMonth()];
       },
       selectDate: function (e) {
-        var month_str = (calendar.getMonth() + 1).toLocaleString('en-US', {
-          minimumIntegerDigits: 2,
-          useGrouping: false
-        })
-        var day_str = e.target.textContent.toLocaleString('en-US', {
-          minimumIntegerDigits: 2,
-          useGrouping: false
-        })
-        selected_date = `${calendar.getFullYear()}-${month_str}-${day_str}`;
+        // Zero padded (YYYY-mm-dd), so dates can be compared as strings
+        selected_date = calendarControl.isoDate(Number(e.target.textContent));
         date = `${e.target.textContent} ${
             calendarControl.calMonthName[calendar.getMonth()]
         } ${calendar.getFullYear()}`;
@@ -120,6 +113,22 @@ function CalendarControl(id) {
           ).innerHTML += `<div>${calendarControl.calWeekDays[i]}</div>`;
         }
       },
+      isoDate: function (day) {
+        var month_str = (calendar.getMonth() + 1).toLocaleString('en-US', {
+          minimumIntegerDigits: 2,
+          useGrouping: false
+        })
+        var day_str = day.toLocaleString('en-US', {
+          minimumIntegerDigits: 2,
+          useGrouping: false
+        })
+        return `${calendar.getFullYear()}-${month_str}-${day_str}`;
+      },
+      dateItem: function (day) {
+        // Days without grids for the selected resolution are greyed out and can not be selected
+        var unavailable = is_available(calendarControl.isoDate(day)) ? "" : " unavailable";
+        return `<div class="number-item${unavailable}" data-num=${day}><a class="dateNumber${unavailable}" href="#">${day}</a></div>`;
+      },
       plotDates: function () {
         document.querySelector(`#${parent_id} .calendar .calendar-body`).innerHTML = "";
         calendarControl.plotDayNames();
@@ -145,24 +154,24 @@ function CalendarControl(id) {
           } else {
             document.querySelector(
                 `#${parent_id} .calendar .calendar-body`
-            ).innerHTML += `<div class="number-item" data-num=${count}><a class="dateNumber" href="#">${count++}</a></div>`;
+            ).innerHTML += calendarControl.dateItem(count++);
           }
         }
         //remaining dates after month dates
         for (let j = 0; j < prevDateCount + 1; j++) {
           document.querySelector(
             `#${parent_id} .calendar .calendar-body`
-          ).innerHTML += `<div class="number-item" data-num=${count}><a class="dateNumber" href="#">${count++}</a></div>`;
+          ).innerHTML += calendarControl.dateItem(count++);
         }
         calendarControl.highlightToday();
         calendarControl.plotPrevMonthDates(prevMonthDatesArray);
         calendarControl.plotNextMonthDates();
       },
-      attachEvents: function () {
+      attachControlEvents: function () {
+        // The controls are only plotted once (see plotSelectors), so their events are attached once
         let prevBtn = document.querySelector(`#${parent_id} .calendar .calendar-prev a`);
         let nextBtn = document.querySelector(`#${parent_id} .calendar .calendar-next a`);
         let todayDate = document.querySelector(`#${parent_id} .calendar .calendar-today-date`);
-        let dateNumber = document.querySelectorAll(`#${parent_id} .calendar .dateNumber`);
         prevBtn.addEventListener(
           "click",
           calendarControl.navigateToPreviousMonth
@@ -172,6 +181,10 @@ function CalendarControl(id) {
           "click",
           calendarControl.navigateToCurrentMonth
         );
+      },
+      attachEvents: function () {
+        // The dates are plotted again for each month, so their events are attached after each plot
+        let dateNumber = document.querySelectorAll(`#${parent_id} .calendar .dateNumber:not(.unavailable)`);
         for (var i = 0; i < dateNumber.length; i++) {
             dateNumber[i].addEventListener(
               "click",
@@ -231,11 +244,13 @@ function CalendarControl(id) {
       },
       init: function () {
         calendarControl.plotSelectors();
+        calendarControl.attachControlEvents();
         calendarControl.plotDates();
         calendarControl.attachEvents();
       }
     };
     calendarControl.init();
+    return calendarControl;
 }
 
 function toggle_calender(id){
@@ -251,6 +266,7 @@ function toggle_calender(id){
     }
     
 }
+var calenders = [];
 function setup_calenders(){
     var listen_ids = ["start-date", "end-date"]
     for (const id of listen_ids){
@@ -260,7 +276,14 @@ function setup_calenders(){
         element.addEventListener('click', function(){
             toggle_calender(id);
         });
-        new CalendarControl(id);
+        calenders.push(new CalendarControl(id));
+    }
+}
+
+function refresh_calenders(){
+    // Plots the dates again, e.g. when the available dates changes
+    for (const calender of calenders){
+        calender.attachEventsOnNextPrev();
     }
 }
 